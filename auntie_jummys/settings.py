@@ -42,17 +42,47 @@ TEMPLATES = [{
         'django.contrib.auth.context_processors.auth',
         'django.contrib.messages.context_processors.messages',
         'shop.context_processors.cart',
+        'shop.context_processors.catalog',
     ]},
 }]
 
 WSGI_APPLICATION = 'auntie_jummys.wsgi.application'
 
+# SQLite tuned for several gunicorn workers: persistent connections, a lock
+# wait instead of "database is locked", and the PRAGMAs below (see shop/db.py).
+SQLITE_BUSY_TIMEOUT = env.int("SQLITE_BUSY_TIMEOUT", default=20)  # seconds
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': env.int("DB_CONN_MAX_AGE", default=600),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT},
+        # file, not in-memory, so tests see real WAL locking between threads
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT * 1000,
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -32000,  # KiB
+    'temp_store': 'MEMORY',
+}
+
+# Shared cache (pages, fragments, catalog version). The file backend is shared by
+# every gunicorn worker on the box; point CACHE_URL at redis/memcached to scale out.
+if env("CACHE_URL", default=""):
+    CACHES = {'default': env.cache("CACHE_URL")}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / '.django_cache',
+        }
+    }
+STOREFRONT_CACHE_SECONDS = env.int("STOREFRONT_CACHE_SECONDS", default=600)
 
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'America/Indiana/Indianapolis'
@@ -73,6 +103,13 @@ SQUARE_ACCESS_TOKEN = env("SQUARE_ACCESS_TOKEN", default="")
 SQUARE_ENV = env("SQUARE_ENV", default="sandbox")
 SQUARE_LOCATION_ID = env("SQUARE_LOCATION_ID", default="")
 SQUARE_WEBHOOK_SIGNATURE_KEY = env("SQUARE_WEBHOOK_SIGNATURE_KEY", default="")
+# Square API timeouts in seconds (connect, read)
+SQUARE_CONNECT_TIMEOUT = env.float("SQUARE_CONNECT_TIMEOUT", default=3.05)
+SQUARE_READ_TIMEOUT = env.float("SQUARE_READ_TIMEOUT", default=20)
+# Stock is the IN_STOCK total across these locations (comma-separated)
+SQUARE_INVENTORY_LOCATION_IDS = env.list("SQUARE_INVENTORY_LOCATION_IDS", default=[SQUARE_LOCATION_ID] if SQUARE_LOCATION_ID else [])
+# Catalog syncs are deltas; a full reconcile runs when the last one is older than this
+SQUARE_FULL_SYNC_HOURS = env.int("SQUARE_FULL_SYNC_HOURS", default=24)
 
 # Email (SMTP)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -94,6 +131,12 @@ STORE_PHONE = env("STORE_PHONE", default="+1-317-000-0000")
 # Tiered delivery fee config: e.g. "5:3,10:5,999:8" (miles:fee)
 DELIVERY_FEE_TIERS = env("DELIVERY_FEE_TIERS", default="5:3,10:5,999:8")
 
+# Max pickup orders per 30-minute slot (0 = unlimited)
+PICKUP_SLOT_CAPACITY = env.int("PICKUP_SLOT_CAPACITY", default=6)
+
+# Prebuilt ZIP centroid index (python manage.py build_zip_index)
+ZIP_INDEX_PATH = env("ZIP_INDEX_PATH", default=str(BASE_DIR / "zip_centroids.npy"))
+
 
 # Free delivery threshold (cart total after discount); set empty or 0 to disable
 from decimal import Decimal
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import path
 from django.shortcuts import redirect
 from django.contrib import messages
-from .models import Category, Product, Order, OrderItem, DeliveryZone, DeliveryWindow, PromoCode, PickupWindow, DeliveryRate
+from .models import Category, Product, Order, OrderItem, DeliveryZone, DeliveryWindow, PromoCode, PickupWindow, DeliveryRate, Job, WebhookEvent, OutboundEmail, InventoryDeduction
 from .square_sync import pull_catalog
 
 @admin.register(Category)
@@ -23,8 +23,10 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("id","customer_name","email","created","paid","fulfillment_method","promo_code","discount_amount","delivery_fee")
+    list_display = ("id","customer_name","email","created","paid","fulfillment_method","promo_code","discount_amount","delivery_fee","grand_total")
+    readonly_fields = ("subtotal","grand_total")
     list_filter = ("paid","created")
+    search_fields = ("customer_name","email","square_order_id","square_payment_link_id")
     inlines = [OrderItemInline]
 
 @admin.register(PromoCode)
@@ -46,8 +48,8 @@ class DeliveryWindowAdmin(admin.ModelAdmin):
 # Admin URL to trigger Square sync
 def sync_from_square(request):
     try:
-        created, updated = pull_catalog()
-        messages.success(request, f"Square sync: {created} created, {updated} updated.")
+        result = pull_catalog()
+        messages.success(request, f"Square sync: {result.created} created, {result.updated} updated, {result.unchanged} unchanged, {result.deactivated} deactivated.")
     except Exception as e:
         messages.error(request, f"Square sync failed: {e}")
     return redirect('/admin/')
@@ -73,3 +75,59 @@ class PickupWindowAdmin(admin.ModelAdmin):
 class DeliveryRateAdmin(admin.ModelAdmin):
     list_display = ("postal_code","fee")
     search_fields = ("postal_code",)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id","kind","status","attempts","max_attempts","run_after","locked_by","updated")
+    list_filter = ("status","kind")
+    readonly_fields = ("last_error","created","updated")
+    actions = ["retry_now"]
+
+    @admin.action(description="Retry selected jobs now")
+    def retry_now(self, request, queryset):
+        from django.utils import timezone
+        n = queryset.exclude(status=Job.RUNNING).update(status=Job.PENDING, attempts=0, run_after=timezone.now())
+        messages.success(request, f"{n} jobs queued for retry.")
+
+@admin.register(InventoryDeduction)
+class InventoryDeductionAdmin(admin.ModelAdmin):
+    list_display = ("id","order","square_variation_id","quantity","status","attempts","batch_key","created","sent_at")
+    list_filter = ("status",)
+    search_fields = ("square_variation_id","batch_key")
+    readonly_fields = ("last_error",)
+    actions = ["retry_now"]
+
+    @admin.action(description="Retry selected failed deductions")
+    def retry_now(self, request, queryset):
+        from .inventory import FLUSH_JOB
+        from .jobs import enqueue
+        # back to PENDING so the next flush re-batches them under a fresh key
+        n = queryset.filter(status=InventoryDeduction.FAILED).update(
+            status=InventoryDeduction.PENDING, batch_key='', attempts=0)
+        if n:
+            enqueue(FLUSH_JOB)
+        messages.success(request, f"{n} deductions queued for retry.")
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id","event_type","order","received")
+    search_fields = ("event_id",)
+    list_filter = ("event_type",)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("id","subject","to","status","attempts","next_attempt_at","claimed_at","sent_at")
+    list_filter = ("status",)
+    search_fields = ("to","subject")
+    readonly_fields = ("order","last_error","created","claimed_at","sent_at")
+    actions = ["retry_now"]
+
+    @admin.action(description="Retry selected emails now")
+    def retry_now(self, request, queryset):
+        from django.utils import timezone
+        from .emails import stale_claims
+        # SENDING rows only once their claim is stale, so a live sender isn't raced
+        retry = queryset.filter(status__in=[OutboundEmail.PENDING, OutboundEmail.FAILED]) | queryset & stale_claims()
+        n = OutboundEmail.objects.filter(id__in=retry.values('id')).update(
+            status=OutboundEmail.PENDING, attempts=0, next_attempt_at=timezone.now(), claimed_by='', claimed_at=None)
+        messages.success(request, f"{n} emails queued for retry.")
@@ -3,5 +3,6 @@ from . import api_views
 
 urlpatterns = [
     path('products/', api_views.product_list),
+    path('products/suggest/', api_views.product_suggest),
     path('products/<slug:slug>/', api_views.product_detail),
 ]
@@ -1,18 +1,87 @@
 from django.http import JsonResponse, Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import Product
+from .suggest import suggest
+from .catalog_snapshot import snapshot_response
+
+# public field name -> ORM lookup
+API_FIELDS = {
+    'id': 'id', 'name': 'name', 'slug': 'slug', 'price': 'price', 'stock': 'stock',
+    'description': 'description', 'sales_count': 'sales_count', 'featured': 'featured',
+    'sku': 'sku', 'upc': 'upc', 'category': 'category__slug', 'updated': 'updated', 'active': 'active',
+}
+DEFAULT_FIELDS = ('id','name','slug','price','stock','sales_count','featured','category','updated')
+PAGE_PARAMS = {'limit', 'cursor', 'fields', 'category', 'featured', 'in_stock', 'updated_since', 'include_inactive'}
+DEFAULT_LIMIT, MAX_LIMIT = 100, 500
+
+class _BadRequest(ValueError):
+    pass
+
+def _flag(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+def _page(params):
+    try:
+        limit = max(1, min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+        cursor = int(params.get('cursor') or 0)
+    except ValueError:
+        raise _BadRequest("limit and cursor must be integers")
+    fields = [f.strip() for f in params.get('fields', '').split(',') if f.strip()] or list(DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in API_FIELDS]
+    if unknown:
+        raise _BadRequest(f"unknown fields: {', '.join(unknown)}")
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+
+    qs = Product.objects.all() if _flag(params.get('include_inactive', '')) else Product.objects.filter(active=True)
+    if params.get('category'):
+        qs = qs.filter(category__slug=params['category'])
+    if params.get('featured'):
+        qs = qs.filter(featured=_flag(params['featured']))
+    if _flag(params.get('in_stock', '')):
+        qs = qs.filter(stock__gt=0)
+    if params.get('updated_since'):
+        since = parse_datetime(params['updated_since'])
+        if since is None:
+            raise _BadRequest("updated_since must be an ISO 8601 datetime")
+        qs = qs.filter(updated__gte=since if timezone.is_aware(since) else timezone.make_aware(since))
+
+    lookups = {f: API_FIELDS[f] for f in fields}
+    rows = list(qs.filter(id__gt=cursor).order_by('id').values(*lookups.values())[:limit + 1])
+    has_more = len(rows) > limit
+    results = [{f: row[lookup] for f, lookup in lookups.items()} for row in rows[:limit]]
+    return {'results': results, 'next_cursor': results[-1]['id'] if has_more else None}
 
 def product_list(request):
-    qs = Product.objects.filter(active=True).values('id','name','slug','price','stock','description','sales_count','featured')
-    return JsonResponse(list(qs), safe=False)
+    """Full active catalog (precompressed snapshot with ETag) by default. Any of PAGE_PARAMS switches to a keyset-paginated
+    page: ?limit=&cursor=<last id>&fields=a,b&category=<slug>&featured=1&in_stock=1&updated_since=<iso>"""
+    if PAGE_PARAMS & set(request.GET):
+        try:
+            return JsonResponse(_page(request.GET))
+        except _BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return snapshot_response(request)
 
 def product_detail(request, slug):
     try:
-        p = Product.objects.get(slug=slug, active=True)
+        p = Product.objects.select_related('category').get(slug=slug, active=True)
     except Product.DoesNotExist:
         raise Http404
     data = {
         'id': p.id, 'name': p.name, 'slug': p.slug,
         'price': str(p.price), 'stock': p.stock,
         'description': p.description,
+        'sku': p.sku, 'upc': p.upc, 'featured': p.featured,
+        'category': {'name': p.category.name, 'slug': p.category.slug},
+        'updated': p.updated,
     }
     return JsonResponse(data)
+
+def product_suggest(request):
+    q = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 8)), 20))
+    except ValueError:
+        limit = 8
+    return JsonResponse({'query': q, 'results': suggest(q, limit) if q else []})
@@ -2,3 +2,9 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals, tasks  # noqa: F401
+        from .db import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid='shop.db.configure_connection')
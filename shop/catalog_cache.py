@@ -0,0 +1,81 @@
+"""Storefront caching keyed on a catalog version.
+
+Any save/delete of a Product, Category or PromoCode bumps the version (see
+shop.signals), which retires every cached page, fragment and ETag at once.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+VERSION_KEY = 'catalog:version'
+
+
+def catalog_version():
+    v = cache.get(VERSION_KEY)
+    if v is None:
+        # Seed from the clock so a cleared cache never reuses an old version.
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        v = cache.get(VERSION_KEY)
+    return v
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), None)
+
+
+def catalog_last_modified(version=None):
+    """Newest Product.updated as a unix timestamp, computed once per version."""
+    from .models import Product
+    key = f'catalog:lastmod:{version or catalog_version()}'
+    ts = cache.get(key)
+    if ts is None:
+        newest = Product.objects.aggregate(m=Max('updated'))['m']
+        ts = int(newest.timestamp()) if newest else 0
+        cache.set(key, ts, settings.STOREFRONT_CACHE_SECONDS)
+    return ts or None
+
+
+def storefront_page(view):
+    """Serve a storefront GET from the page cache, answering 304 when the ETag or
+    Last-Modified still match. Pages with pending flash messages bypass both."""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+            return view(request, *args, **kwargs)
+
+        version = catalog_version()
+        near_zip = request.session.get('last_zip') or ''
+        path_hash = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+        etag = quote_etag(f"{version}-{path_hash}-{near_zip}")
+        last_modified = catalog_last_modified(version)
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        key = f'page:{version}:{path_hash}:{near_zip}'
+        hit = cache.get(key)
+        if hit is not None:
+            content, content_type = hit
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, (response.content, response['Content-Type']), settings.STOREFRONT_CACHE_SECONDS)
+        response.headers['ETag'] = etag
+        if last_modified:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+    return wrapped
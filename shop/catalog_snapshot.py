@@ -0,0 +1,111 @@
+"""Pre-serialized, pre-compressed snapshot of the active catalog for /api/products/.
+
+Built once per catalog version and kept in the cache as identity/gzip/brotli
+bytes. The ETag is stored on its own so a 304 only needs two small cache reads.
+Stock and sales_count change without a version bump, so a snapshot is only kept
+for CACHE_SECONDS; the ETag hashes the body, so pollers still get 304 until the
+data actually changes.
+"""
+import gzip
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from .catalog_cache import catalog_version
+from .models import Product
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FIELDS = ('id','name','slug','price','stock','description','sales_count','featured')
+CACHE_SECONDS = 60
+
+
+def _key(version, part):
+    return f'catalog:snapshot:{part}:{version}'
+
+
+def build(version=None):
+    version = version or catalog_version()
+    rows = list(Product.objects.filter(active=True).values(*FIELDS))
+    body = json.dumps(rows, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+    snap = {'identity': body, 'gzip': gzip.compress(body, 6, mtime=0)}
+    if brotli is not None:
+        snap['br'] = brotli.compress(body)
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    cache.set(_key(version, 'body'), snap, CACHE_SECONDS)
+    cache.set(_key(version, 'etag'), etag, CACHE_SECONDS)
+    return etag, snap
+
+
+def rebuild():
+    """Build the snapshot for the current version now, e.g. right after a bulk sync."""
+    return build(catalog_version())
+
+
+def _tag(etag, enc):
+    # one strong validator per representation
+    return f'"{etag}"' if enc == 'identity' else f'"{etag}-{enc}"'
+
+
+def _accepted(header):
+    """{coding: q} from an Accept-Encoding header; a missing or bad q counts as 1."""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        name, _, value = params.partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                q = float(value)
+            except ValueError:
+                pass
+        accepted[coding] = q
+    return accepted
+
+
+def _encoding(request, available):
+    accepted = _accepted(request.headers.get('Accept-Encoding', ''))
+    wildcard = accepted.get('*', 0)
+    # highest q wins; br before gzip on a tie
+    best = max(('br', 'gzip'), key=lambda enc: accepted.get(enc, wildcard) if enc in available else 0)
+    if best in available and accepted.get(best, wildcard) > 0:
+        return best
+    return 'identity'
+
+
+def snapshot_response(request):
+    version = catalog_version()
+    etag = cache.get(_key(version, 'etag'))
+    snap = None
+    if etag is None:
+        etag, snap = build(version)
+
+    available = ('identity', 'gzip') + (('br',) if brotli is not None else ())
+    enc = _encoding(request, available)
+    tag = _tag(etag, enc)
+    if tag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        if snap is None:
+            snap = cache.get(_key(version, 'body'))
+            if snap is None:
+                etag, snap = build(version)
+        if enc not in snap:
+            enc = 'identity'
+        tag = _tag(etag, enc)
+        response = HttpResponse(snap[enc], content_type='application/json')
+        if enc != 'identity':
+            response.headers['Content-Encoding'] = enc
+    response.headers['ETag'] = tag
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
@@ -1,2 +1,7 @@
+from .catalog_cache import catalog_version
+
 def cart(request):
     return {'cart': request.session.get('cart', {})}
+
+def catalog(request):
+    return {'catalog_version': catalog_version()}
@@ -0,0 +1,42 @@
+"""SQLite tuning for several gunicorn workers sharing one database file.
+
+Every new connection gets SQLITE_PRAGMAS (WAL, synchronous=NORMAL, busy
+timeout, mmap and page cache). Write paths that read before they write use
+immediate_atomic(), which opens the transaction with BEGIN IMMEDIATE: the write
+lock is taken up front, so a competing writer waits out busy_timeout instead
+of failing with "database is locked" when its read lock can't be upgraded.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cur:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cur.execute(f"PRAGMA {pragma} = {value}")
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """transaction.atomic() that starts with BEGIN IMMEDIATE on SQLite. Nested
+    inside another atomic block it is a plain savepoint; other backends get a
+    normal atomic block."""
+    conn = transaction.get_connection(using)
+    if conn.vendor != 'sqlite' or conn.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    # Django 5.0 has no "transaction_mode" option; swap the BEGIN it issues.
+    conn.ensure_connection()
+    begin = conn._start_transaction_under_autocommit
+    conn._start_transaction_under_autocommit = lambda: conn.cursor().execute("BEGIN IMMEDIATE")
+    try:
+        with transaction.atomic(using=using):
+            conn._start_transaction_under_autocommit = begin
+            yield
+    finally:
+        conn._start_transaction_under_autocommit = begin
@@ -1,17 +1,93 @@
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+"""Order emails go through the OutboundEmail outbox: rendered here, delivered
+in batches over one SMTP connection by `manage.py send_outbox`."""
+import uuid
+from datetime import timedelta
+
 from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .jobs import backoff_seconds
+from .models import OutboundEmail
+
+MAX_ATTEMPTS = 6
+STALE_AFTER = timedelta(minutes=10)
+
+def _queue(order, subject, template):
+    body = render_to_string(template, {"order": order})
+    recipients = [order.email]
+    if getattr(settings, "ORDER_NOTIFY_EMAIL", None):
+        recipients.append(settings.ORDER_NOTIFY_EMAIL)
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(order=order, subject=subject, body=body, from_email=settings.DEFAULT_FROM_EMAIL, to=to)
+        for to in recipients
+    ])
 
 def send_order_received(order):
     subject = f"Order #{order.id} received — Auntie Jummy’s"
-    body = render_to_string("emails/order_received.txt", {"order": order})
-    send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [order.email], fail_silently=True)
-    if getattr(settings, "ORDER_NOTIFY_EMAIL", None):
-        send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [settings.ORDER_NOTIFY_EMAIL], fail_silently=True)
+    return _queue(order, subject, "emails/order_received.txt")
 
 def send_payment_confirmed(order):
     subject = f"Payment confirmed for Order #{order.id} — Auntie Jummy’s"
-    body = render_to_string("emails/payment_confirmed.txt", {"order": order})
-    send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [order.email], fail_silently=True)
-    if getattr(settings, "ORDER_NOTIFY_EMAIL", None):
-        send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [settings.ORDER_NOTIFY_EMAIL], fail_silently=True)
+    return _queue(order, subject, "emails/payment_confirmed.txt")
+
+def stale_claims():
+    """SENDING rows whose sender died mid-batch (no claim time counts as stale)."""
+    return OutboundEmail.objects.filter(status=OutboundEmail.SENDING).filter(
+        Q(claimed_at__lt=timezone.now() - STALE_AFTER) | Q(claimed_at__isnull=True))
+
+def release_stale():
+    """Put stale SENDING rows back in the queue. A row whose message went out just
+    before the crash is sent again; a duplicate beats a lost confirmation."""
+    return stale_claims().update(status=OutboundEmail.PENDING, claimed_by='', claimed_at=None)
+
+def _claim(limit):
+    token, now = uuid.uuid4().hex, timezone.now()
+    due = OutboundEmail.objects.filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+    OutboundEmail.objects.filter(id__in=due.values('id')[:limit], status=OutboundEmail.PENDING).update(
+        status=OutboundEmail.SENDING, claimed_by=token, claimed_at=now)
+    return list(OutboundEmail.objects.filter(claimed_by=token, status=OutboundEmail.SENDING))
+
+def _failed(em, exc):
+    em.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+    if em.attempts >= MAX_ATTEMPTS:
+        em.status = OutboundEmail.FAILED
+    else:
+        em.status = OutboundEmail.PENDING
+        em.next_attempt_at = timezone.now() + timedelta(seconds=backoff_seconds(em.attempts, base=60))
+
+def _message(em):
+    return EmailMessage(em.subject, em.body, em.from_email, [em.to])
+
+def send_outbox(limit=100, connection=None):
+    """Deliver one batch of due emails over a single connection. Returns (sent, failed)."""
+    release_stale()
+    batch = _claim(limit)
+    if not batch:
+        return 0, 0
+    sent = 0
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for em in batch:
+            em.attempts += 1
+            _failed(em, e)
+    else:
+        for em in batch:
+            em.attempts += 1
+            try:
+                connection.send_messages([_message(em)])
+            except Exception as e:
+                _failed(em, e)
+            else:
+                sent += 1
+                em.status, em.sent_at, em.last_error = OutboundEmail.SENT, timezone.now(), ''
+        connection.close()
+    for em in batch:
+        em.claimed_by, em.claimed_at = '', None
+    OutboundEmail.objects.bulk_update(
+        batch, ['status', 'attempts', 'next_attempt_at', 'claimed_by', 'claimed_at', 'last_error', 'sent_at'])
+    return sent, len(batch) - sent
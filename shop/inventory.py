@@ -0,0 +1,82 @@
+"""Buffered Square inventory deductions.
+
+Paid orders add InventoryDeduction rows instead of calling Square directly. A
+flush job, delayed by WINDOW so busy-hour orders pile up, coalesces pending rows
+per variation and sends them in chunks of at most BATCH_CHANGE_LIMIT changes.
+Each chunk's idempotency key is a hash of its (order, variation) pairs, so a
+retried flush resends the same key and Square won't deduct twice. A batch Square
+rejects is retried on the next run (the job raises so the queue backs off) and
+parked as FAILED after MAX_ATTEMPTS; the other batches keep going out.
+"""
+import hashlib
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .jobs import enqueue, handler
+from .models import InventoryDeduction, Job, OrderItem
+from .square_sync import BATCH_CHANGE_LIMIT, push_inventory_deduction
+
+WINDOW = timedelta(seconds=30)
+MAX_ATTEMPTS = 5
+FLUSH_JOB = 'flush_inventory_deductions'
+
+
+def buffer_order(order_id):
+    """Queue the order's lines for deduction; safe to call more than once."""
+    lines = (OrderItem.objects.filter(order_id=order_id).exclude(product__square_variation_id='')
+             .values('product__square_variation_id').annotate(q=Sum('quantity')))
+    InventoryDeduction.objects.bulk_create([
+        InventoryDeduction(order_id=order_id, square_variation_id=l['product__square_variation_id'], quantity=l['q'])
+        for l in lines if l['q'] > 0
+    ], ignore_conflicts=True)
+    if not Job.objects.filter(kind=FLUSH_JOB, status=Job.PENDING).exists():
+        enqueue(FLUSH_JOB, run_after=timezone.now() + WINDOW)
+
+
+def _batch_key(rows):
+    pairs = sorted((r.order_id, r.square_variation_id) for r in rows)
+    return hashlib.sha256(repr(pairs).encode('utf-8')).hexdigest()[:40]
+
+
+def _claim():
+    """Move pending rows into CLAIMED batches of at most BATCH_CHANGE_LIMIT variations."""
+    by_var = defaultdict(list)
+    for pk, var_id in InventoryDeduction.objects.filter(status=InventoryDeduction.PENDING).values_list('id', 'square_variation_id'):
+        by_var[var_id].append(pk)
+    var_ids = sorted(by_var)
+    for i in range(0, len(var_ids), BATCH_CHANGE_LIMIT):
+        ids = [pk for v in var_ids[i:i+BATCH_CHANGE_LIMIT] for pk in by_var[v]]
+        token = uuid.uuid4().hex
+        InventoryDeduction.objects.filter(id__in=ids, status=InventoryDeduction.PENDING).update(
+            status=InventoryDeduction.CLAIMED, batch_key=token)
+        # key the batch on the rows we actually got, for identical retries
+        rows = list(InventoryDeduction.objects.filter(batch_key=token))
+        if rows:
+            InventoryDeduction.objects.filter(batch_key=token).update(batch_key=_batch_key(rows))
+
+
+@handler(FLUSH_JOB)
+def flush():
+    """Send every claimed batch, including ones left over from a failed run."""
+    _claim()
+    keys = (InventoryDeduction.objects.filter(status=InventoryDeduction.CLAIMED)
+            .values_list('batch_key', flat=True).order_by('batch_key').distinct())
+    sent, failed = 0, []
+    for key in list(keys):
+        rows = InventoryDeduction.objects.filter(batch_key=key, status=InventoryDeduction.CLAIMED)
+        totals = rows.values_list('square_variation_id').annotate(q=Sum('quantity')).order_by('square_variation_id')
+        try:
+            push_inventory_deduction(list(totals), idempotency_key=f"inv-{key}")
+        except Exception as e:
+            rows.update(attempts=F('attempts') + 1, last_error=f"{type(e).__name__}: {e}"[:2000])
+            rows.filter(attempts__gte=MAX_ATTEMPTS).update(status=InventoryDeduction.FAILED)
+            failed.append(key)
+            continue
+        sent += rows.update(status=InventoryDeduction.SENT, sent_at=timezone.now(), last_error='')
+    if InventoryDeduction.objects.filter(batch_key__in=failed, status=InventoryDeduction.CLAIMED).exists():
+        raise RuntimeError(f"{len(failed)} inventory batches failed; sent {sent} rows")
+    return sent
@@ -0,0 +1,98 @@
+"""Durable DB-backed job queue.
+
+Producers call enqueue(); `manage.py run_worker` claims due jobs, runs the
+registered handler, and retries failures with exponential backoff until
+max_attempts, after which the job is parked as DEAD for a human to look at.
+"""
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+log = logging.getLogger(__name__)
+
+HANDLERS = {}
+STALE_AFTER = timedelta(minutes=10)
+
+
+def handler(kind):
+    """Register fn(**payload) as the handler for a job kind."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, run_after=None, max_attempts=None, **payload):
+    job = Job(kind=kind, payload=payload, run_after=run_after or timezone.now())
+    if max_attempts:
+        job.max_attempts = max_attempts
+    job.save()
+    return job
+
+
+def backoff_seconds(attempts, base=15, cap=3600):
+    """15s, 30s, 60s ... capped at an hour, with +/-20% jitter."""
+    return min(cap, base * 2 ** max(0, attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def claim(worker, limit=10):
+    """Atomically move up to `limit` due jobs to RUNNING for this worker."""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.PENDING, run_after__lte=now).order_by('run_after', 'id')
+    token = f"{worker}:{uuid.uuid4().hex[:8]}"
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(id__in=ids).update(
+                status=Job.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1)
+    else:
+        # No row locks (SQLite): a single UPDATE is atomic, and the status
+        # re-check makes sure two workers never take the same row.
+        Job.objects.filter(id__in=due.values('id')[:limit], status=Job.PENDING).update(
+            status=Job.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(locked_by=token, status=Job.RUNNING).order_by('run_after', 'id'))
+
+
+def run(job):
+    fn = HANDLERS.get(job.kind)
+    try:
+        if fn is None:
+            raise LookupError(f"No handler registered for {job.kind!r}")
+        fn(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()[-4000:]
+        if job.attempts >= job.max_attempts:
+            job.status = Job.DEAD
+            log.error("Job %s dead after %s attempts", job, job.attempts)
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=backoff_seconds(job.attempts))
+            log.warning("Job %s failed (attempt %s), retrying at %s", job, job.attempts, job.run_after)
+    else:
+        job.status = Job.DONE
+        job.last_error = ''
+    job.locked_by = ''
+    job.save(update_fields=['status', 'run_after', 'last_error', 'locked_by', 'updated'])
+    return job.status
+
+
+def release_stale():
+    """Return jobs whose worker died mid-run to the queue."""
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - STALE_AFTER).update(
+        status=Job.PENDING, locked_by='')
+
+
+def work(worker, limit=10):
+    """Claim and run one batch; returns the number of jobs processed."""
+    jobs = claim(worker, limit)
+    for job in jobs:
+        run(job)
+    return len(jobs)
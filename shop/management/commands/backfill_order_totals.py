@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shop.models import Order
+
+class Command(BaseCommand):
+    help = "Recompute the stored Order.subtotal/grand_total from order items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        size = opts['chunk_size']
+        qs = (Order.objects.with_totals().order_by('pk')
+              .only('pk', 'subtotal', 'grand_total', 'discount_amount', 'delivery_fee'))
+        fixed = seen = 0
+        last_pk = 0
+        while True:
+            batch = list(qs.filter(pk__gt=last_pk)[:size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            seen += len(batch)
+            stale = []
+            for o in batch:
+                if o.subtotal != o.calc_subtotal or o.grand_total != o.calc_total:
+                    o.subtotal, o.grand_total = o.calc_subtotal, o.calc_total
+                    stale.append(o)
+            with transaction.atomic():
+                Order.objects.bulk_update(stale, ['subtotal', 'grand_total'])
+            fixed += len(stale)
+        self.stdout.write(self.style.SUCCESS(f"Checked {seen} orders, updated {fixed}"))
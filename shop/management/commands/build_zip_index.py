@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop import zipindex
+
+class Command(BaseCommand):
+    help = "Build the memory-mapped ZIP centroid index used for delivery-fee quotes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--out', default=None, help="Defaults to settings.ZIP_INDEX_PATH")
+
+    def handle(self, *args, **opts):
+        out = opts['out'] or str(settings.ZIP_INDEX_PATH)
+        arr = zipindex.build_from_pgeocode()
+        zipindex.write_index(arr, out)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(arr)} ZIP centroids to {out}"))
@@ -1,12 +1,38 @@
 # shop/management/commands/import_products.py
 import csv
+from collections import defaultdict
 from decimal import Decimal
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
 from django.utils.text import slugify
+from shop.catalog_cache import bump_catalog_version
 from shop.models import Product, Category
+from shop import catalog_snapshot, search
+
+CHUNK = 1000
+# Square's item library export (Items → Export), as in products.csv
+SQUARE_COLUMNS = {"name_col": "Item Name", "price_col": "Price", "cat_col": "Reporting Category",
+                  "sku_col": "SKU", "upc_col": "GTIN", "desc_col": "Description"}
+PRODUCT_FIELDS = ("id", "name", "slug", "category_id", "price", "stock", "sku", "upc",
+                  "description", "active", "square_variation_id")
+
+def clean(value):
+    # distributor sheets wrap ids in pipes: "|5854637|"
+    return (value or "").replace("|", "").strip()
+
+def unique_slug(name, used):
+    base = slugify(name)[:100] or "product"
+    slug, n = base, 2
+    while slug in used:
+        slug = f"{base}-{n}"
+        n += 1
+    used.add(slug)
+    return slug
 
 class Command(BaseCommand):
-    help = "Import products from a CSV/Excel-export. Creates categories if needed."
+    help = ("Import products from a CSV/Excel-export or a Square item library export. "
+            "Creates categories if needed; matches existing products on Square token, SKU, UPC, then name.")
 
     def add_arguments(self, parser):
         parser.add_argument("csv_path", help="Path to CSV in your repo (e.g., data/inventory.csv)")
@@ -18,96 +44,160 @@ class Command(BaseCommand):
         parser.add_argument("--sku-col", default="sku_id")
         parser.add_argument("--upc-col", default="upc_id")
         parser.add_argument("--default-stock", type=int, default=25)
-        parser.add_argument("--encoding", default="utf-8")
+        parser.add_argument("--encoding", default="utf-8-sig")
         parser.add_argument("--delimiter", default=",")
-        parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument("--dry-run", action="store_true", help="Run the import and roll it back")
 
     def handle(self, *args, **opts):
         path = opts["csv_path"]
-        name_col = opts["name_col"]
-        price_col = opts["price_col"]
-        cat_col = opts["cat_col"]
-        stock_col = opts["stock_col"]
-        desc_col = opts["desc_col"]
-        sku_col = opts["sku_col"]
-        upc_col = opts["upc_col"]
-        default_stock = opts["default_stock"]
-
-        created, updated, skipped = 0, 0, 0
-
         try:
             with open(path, "r", encoding=opts["encoding"], newline="") as f:
-                reader = csv.DictReader(f, delimiter=opts["delimiter"])
-                missing = [c for c in (name_col, price_col) if c not in reader.fieldnames]
+                reader = csv.reader(f, delimiter=opts["delimiter"])
+                header = self._header(reader, opts["name_col"])
+                square = "Item Name" in header and opts["name_col"] not in header
+                if square:
+                    opts.update(SQUARE_COLUMNS)
+                    opts["stock_col"] = opts["stock_col"] or next(
+                        (c for c in header if c.startswith("Current Quantity")), None)
+                missing = [c for c in (opts["name_col"], opts["price_col"]) if c not in header]
                 if missing:
                     raise CommandError(f"Missing required columns in CSV: {missing}")
-
-                for row in reader:
-                    name = (row.get(name_col) or "").strip()
-                    if not name:
-                        skipped += 1
-                        continue
-
-                    # price
-                    raw_price = str(row.get(price_col) or "0").strip().replace("$","")
-                    try:
-                        price = Decimal(raw_price)
-                    except Exception:
-                        self.stderr.write(f"Bad price for {name!r}: {raw_price!r} -> skipping")
-                        skipped += 1
-                        continue
-
-                    # category
-                    cat_name = (row.get(cat_col) or row.get("category_l1") or "Uncategorized").strip() if cat_col else "Uncategorized"
-                    cat_slug = slugify(cat_name) or "uncategorized"
-                    category, _ = Category.objects.get_or_create(name=cat_name, defaults={"slug": cat_slug})
-
-                    # existing product?
-                    prod = Product.objects.filter(name__iexact=name).first()
-                    is_new = False
-                    if not prod:
-                        prod = Product(name=name, slug=slugify(name)[:100] or None, category=category)
-                        is_new = True
-                    else:
-                        # update category if changed
-                        if category and prod.category_id != category.id:
-                            prod.category = category
-
-                    prod.price = price
-
-                    # stock
-                    if stock_col and row.get(stock_col):
-                        try:
-                            prod.stock = int(str(row[stock_col]).strip())
-                        except Exception:
-                            prod.stock = default_stock
-                    else:
-                        prod.stock = default_stock
-
-                    # optional fields if your model has them (we added earlier)
-                    if hasattr(prod, "sku") and sku_col:
-                        prod.sku = (row.get(sku_col) or "").strip()
-                    if hasattr(prod, "upc") and upc_col:
-                        prod.upc = (row.get(upc_col) or "").strip()
-                    if hasattr(prod, "allergens"):
-                        prod.allergens = prod.allergens or ""
-
-                    # description (optional)
-                    if desc_col:
-                        prod.description = (row.get(desc_col) or "").strip()
-
-                    if opts["dry_run"]:
-                        self.stdout.write(f"DRY-RUN: {'CREATE' if is_new else 'UPDATE'} {name} ${price} stock={prod.stock} cat={category.name}")
-                    else:
-                        prod.save()
-                        if is_new:
-                            created += 1
-                        else:
-                            updated += 1
-
+                rows = (dict(zip(header, r)) for r in reader)
+                if opts["dry_run"]:
+                    with transaction.atomic():
+                        counts, changed_ids = self._import(rows, header, square, opts)
+                        transaction.set_rollback(True)
+                else:
+                    # no outer transaction: each chunk commits and releases the write lock
+                    counts, changed_ids = self._import(rows, header, square, opts)
         except FileNotFoundError:
             raise CommandError(f"CSV not found at {path}. Did you upload it to the repo?")
 
+        created, updated, unchanged, skipped = counts
+        if not opts["dry_run"] and changed_ids:
+            # bulk writes skip the signals that maintain search and caches
+            search.index_products(changed_ids)
+            bump_catalog_version()
+            catalog_snapshot.rebuild()
+
         self.stdout.write(self.style.SUCCESS(
-            f"Done. Created: {created}, Updated: {updated}, Skipped: {skipped}"
+            f"Done. Created: {created}, Updated: {updated}, Unchanged: {unchanged}, Skipped: {skipped}"
         ))
+
+    def _header(self, reader, name_col):
+        """Column names, skipping banner rows some exports put above them."""
+        for _ in range(5):
+            row = next(reader, None)
+            if row is None:
+                break
+            row = [c.strip() for c in row]
+            if name_col in row or "Item Name" in row:
+                return row
+        raise CommandError(f"No header row with {name_col!r} or 'Item Name' found")
+
+    def _import(self, rows, header, square, opts):
+        name_col, price_col, cat_col = opts["name_col"], opts["price_col"], opts["cat_col"]
+        stock_col, desc_col, default_stock = opts["stock_col"], opts["desc_col"], opts["default_stock"]
+        sku_col = opts["sku_col"] if opts["sku_col"] in header else None
+        upc_col = opts["upc_col"] if opts["upc_col"] in header else None
+
+        products = list(Product.objects.only(*PRODUCT_FIELDS).order_by("id"))
+        by_token, by_sku, by_upc, by_name = {}, {}, {}, {}
+        def index(p):
+            for idx, key in ((by_token, p.square_variation_id), (by_sku, p.sku), (by_upc, p.upc), (by_name, p.name.lower())):
+                if key:
+                    idx.setdefault(key, p)
+        for p in products:
+            index(p)
+        used_slugs = {p.slug for p in products}
+        categories = {c.name: c for c in Category.objects.all()}
+        cat_slugs = {c.slug: c for c in categories.values()}
+
+        new, dirty, seen = [], {}, set()
+        skipped = 0
+        for row in rows:
+            name = clean(row.get(name_col))
+            if not name:
+                skipped += 1
+                continue
+            if square:
+                # same naming as square_sync so a later sync matches without renaming
+                name = f"{name} {clean(row.get('Variation Name'))}".strip()
+
+            # price
+            raw_price = clean(row.get(price_col)).replace("$", "").replace(",", "") or "0"
+            try:
+                price = Decimal(raw_price)
+            except Exception:
+                self.stderr.write(f"Bad price for {name!r}: {raw_price!r} -> skipping")
+                skipped += 1
+                continue
+
+            # category
+            cat_name = (clean(row.get(cat_col)) or clean(row.get("category_l1")) or "Uncategorized") if cat_col else "Uncategorized"
+            category = categories.get(cat_name)
+            if category is None:
+                cat_slug = slugify(cat_name) or "uncategorized"
+                category = categories[cat_name] = cat_slugs.get(cat_slug) or Category.objects.create(name=cat_name, slug=cat_slug)
+                cat_slugs[cat_slug] = category
+
+            # stock
+            stock = default_stock
+            if stock_col and clean(row.get(stock_col)):
+                try:
+                    stock = max(0, int(float(clean(row[stock_col]))))
+                except Exception:
+                    pass
+
+            wanted = {"category_id": category.id, "price": price, "stock": stock}
+            if sku_col:
+                wanted["sku"] = clean(row.get(sku_col))
+            if upc_col:
+                wanted["upc"] = clean(row.get(upc_col))
+            if desc_col:
+                wanted["description"] = (row.get(desc_col) or "").strip()
+            token = clean(row.get("Token")) if square else ""
+            if token:
+                wanted["square_variation_id"] = token
+            if square and "Archived" in header:
+                wanted["active"] = clean(row.get("Archived")).upper() != "Y"
+
+            # existing product? Square token, then SKU, UPC, name; a product already tied
+            # to another Square variation is never taken over by a looser match
+            prod = token and by_token.get(token)
+            if not prod:
+                prod = next((p for p in (by_sku.get(wanted.get("sku")), by_upc.get(wanted.get("upc")), by_name.get(name.lower()))
+                             if p and p.square_variation_id in ("", token)), None)
+            is_new = prod is None
+            if is_new:
+                prod = Product(name=name, slug=unique_slug(name, used_slugs), **wanted)
+                new.append(prod)
+                index(prod)
+            else:
+                changed = {f for f, v in wanted.items() if getattr(prod, f) != v}
+                for f in changed:
+                    setattr(prod, f, wanted[f])
+                if prod.pk:
+                    seen.add(prod.pk)
+                    if changed:
+                        dirty.setdefault(prod.pk, (prod, set()))[1].update(changed)
+                index(prod)
+
+            if opts["dry_run"]:
+                self.stdout.write(f"DRY-RUN: {'CREATE' if is_new else 'UPDATE'} {name} ${price} stock={stock} cat={cat_name}")
+
+        now = timezone.now()
+        for i in range(0, len(new), CHUNK):
+            with transaction.atomic():
+                Product.objects.bulk_create(new[i:i+CHUNK])
+        groups = defaultdict(list)
+        for prod, fields in dirty.values():
+            prod.updated = now  # bulk_update skips auto_now
+            groups[tuple(sorted(fields)) + ("updated",)].append(prod)
+        for fields, prods in groups.items():
+            for i in range(0, len(prods), CHUNK):
+                with transaction.atomic():
+                    Product.objects.bulk_update(prods[i:i+CHUNK], fields)
+
+        counts = (len(new), len(dirty), len(seen) - len(dirty), skipped)
+        return counts, [p.pk for p in new] + list(dirty)
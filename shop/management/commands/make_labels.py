@@ -1,59 +1,99 @@
-from django.core.management.base import BaseCommand
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-from reportlab.lib.pagesizes import landscape
-from shop.models import Order
-
-# Brother QL "17mm x 54mm" approx: printable area ~ (54mm x 17mm)
-LABEL_W = 54 * mm
-LABEL_H = 17 * mm
-MARGIN_X = 2 * mm
-MARGIN_Y = 1 * mm
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from shop.labels import header_fields, labels_for_items, order_labels_pdf, render_labels
+from shop.models import Order, OrderItem
 
 class Command(BaseCommand):
-    help = "Generate a PDF of thermal labels (17x54mm) for an order's items."
+    help = ("Generate a PDF of thermal labels (17x54mm) for one order, or a batch of orders "
+            "by id list, created date range or pickup window.")
 
     def add_arguments(self, parser):
-        parser.add_argument('order_id', type=int)
-        parser.add_argument('--out', default='labels.pdf')
+        parser.add_argument('order_ids', type=int, nargs='*')
+        parser.add_argument('--out', default=None, help="Defaults to labels.pdf / labels.zip")
+        parser.add_argument('--since', help="Orders created on/after YYYY-MM-DD")
+        parser.add_argument('--until', help="Orders created on/before YYYY-MM-DD")
+        parser.add_argument('--pickup-from', help="Pickups at/after ISO datetime")
+        parser.add_argument('--pickup-to', help="Pickups before ISO datetime")
+        parser.add_argument('--paid-only', action='store_true')
+        parser.add_argument('--format', choices=['pdf', 'zip'], default='pdf',
+                            help="pdf: one merged file; zip: labels (and slips) per order")
+        parser.add_argument('--slips', action='store_true', help="Add staff/print.html packing slips (zip only)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
 
     def handle(self, *args, **opts):
-        order_id = opts['order_id']
-        out = opts['out']
-        try:
-            order = Order.objects.get(id=order_id)
-        except Order.DoesNotExist:
-            self.stderr.write("Order not found")
+        ids = opts['order_ids']
+        batch = opts['since'] or opts['until'] or opts['pickup_from'] or opts['pickup_to']
+        if not ids and not batch:
+            raise CommandError("Give order ids, --since/--until or --pickup-from/--pickup-to")
+        if opts['slips'] and opts['format'] != 'zip':
+            raise CommandError("Packing slips are HTML; use --format zip")
+        out = opts['out'] or f"labels.{opts['format']}"
+
+        if len(ids) == 1 and not batch and opts['format'] == 'pdf':
+            try:
+                order = Order.objects.get(id=ids[0])
+            except Order.DoesNotExist:
+                self.stderr.write("Order not found")
+                return
+            with open(out, 'wb') as f:
+                f.write(order_labels_pdf(order))
+            self.stdout.write(self.style.SUCCESS(f"Labels written to {out}"))
             return
 
-        # Create a PDF where each page is one label
-        from reportlab.lib.pagesizes import landscape
-        c = canvas.Canvas(out, pagesize=(LABEL_W, LABEL_H))
-
-        for it in order.items.all():
-            name = it.product.name[:32]
-            sku = (it.product.sku or "")[:20]
-            upc = (it.product.upc or "")[:20]
-            allergens = (it.product.allergens or "")[:40]
-
-            # Draw a single label
-            c.setFont("Helvetica-Bold", 9)
-            c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 9, name)
-            c.setFont("Helvetica", 7)
-            c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 9 - 9, f"SKU: {sku}  UPC: {upc}")
-            if allergens:
-                c.setFont("Helvetica-Oblique", 6)
-                c.drawString(MARGIN_X, MARGIN_Y + 3, f"Allergens: {allergens}")
-            # qty copies
-            for _ in range(max(1, it.quantity - 1)):
-                c.showPage()
-                c.setFont("Helvetica-Bold", 9)
-                c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 9, name)
-                c.setFont("Helvetica", 7)
-                c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 9 - 9, f"SKU: {sku}  UPC: {upc}")
-                if allergens:
-                    c.setFont("Helvetica-Oblique", 6)
-                    c.drawString(MARGIN_X, MARGIN_Y + 3, f"Allergens: {allergens}")
-            c.showPage()
-        c.save()
-        self.stdout.write(self.style.SUCCESS(f"Labels written to {out}"))
+        orders = list(self._orders(ids, opts))
+        if not orders:
+            self.stderr.write("No matching orders")
+            return
+
+        if opts['format'] == 'pdf':
+            labels = []
+            for o in orders:
+                labels.append((header_fields(o), 1))
+                labels.extend(labels_for_items(o.items.all()))
+            with open(out, 'wb') as f:
+                f.write(render_labels(labels))
+        else:
+            per_order = [labels_for_items(o.items.all()) for o in orders]
+            workers = max(1, min(opts['workers'], len(orders)))
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    pdfs = list(pool.map(render_labels, per_order, chunksize=max(1, len(orders) // (workers * 4))))
+            else:
+                pdfs = [render_labels(labels) for labels in per_order]
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for o, pdf in zip(orders, pdfs):
+                    zf.writestr(f"order_{o.pk}/labels.pdf", pdf)
+                    if opts['slips']:
+                        zf.writestr(f"order_{o.pk}/slip.html", render_to_string('staff/print.html', {'order': o}))
+        self.stdout.write(self.style.SUCCESS(f"{len(orders)} orders written to {out}"))
+
+    def _orders(self, ids, opts):
+        qs = Order.objects.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('pk'))
+        ).order_by('pickup_at', 'pk')
+        if ids:
+            qs = qs.filter(id__in=ids)
+        for opt, lookup, day_offset in (('since', 'created__gte', 0), ('until', 'created__lt', 1)):
+            if opts[opt]:
+                d = parse_date(opts[opt])
+                if d is None:
+                    raise CommandError(f"Bad --{opt} date: {opts[opt]!r}")
+                qs = qs.filter(**{lookup: timezone.make_aware(datetime.combine(d + timedelta(days=day_offset), time.min))})
+        for opt, lookup in (('pickup_from', 'pickup_at__gte'), ('pickup_to', 'pickup_at__lt')):
+            if opts[opt]:
+                dt = parse_datetime(opts[opt])
+                if dt is None:
+                    raise CommandError(f"Bad --{opt.replace('_', '-')} datetime: {opts[opt]!r}")
+                qs = qs.filter(**{lookup: dt if timezone.is_aware(dt) else timezone.make_aware(dt)})
+        if opts['paid_only']:
+            qs = qs.filter(paid=True)
+        return qs
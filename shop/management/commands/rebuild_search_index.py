@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from shop import search
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text product search index."
+
+    def handle(self, *args, **kwargs):
+        search.ensure_index()
+        search.index_products()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
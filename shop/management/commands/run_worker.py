@@ -0,0 +1,31 @@
+import os
+import socket
+import time
+from django.core.management.base import BaseCommand
+from shop import jobs
+from shop import tasks  # noqa: F401  registers handlers
+
+class Command(BaseCommand):
+    help = "Run background jobs (webhook side effects etc.) from the DB queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=2.0, help="Idle poll interval in seconds")
+        parser.add_argument('--once', action='store_true', help="Drain due jobs and exit")
+
+    def handle(self, *args, **opts):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Worker {worker} started")
+        total = 0
+        try:
+            while True:
+                jobs.release_stale()
+                n = jobs.work(worker, opts['batch'])
+                total += n
+                if not n:
+                    if opts['once']:
+                        break
+                    time.sleep(opts['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker} processed {total} jobs"))
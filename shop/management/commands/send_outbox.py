@@ -0,0 +1,38 @@
+import time
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from shop import emails
+from shop.models import OutboundEmail
+
+class Command(BaseCommand):
+    help = "Deliver queued order emails in batches over one SMTP connection per batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when the outbox is empty")
+        parser.add_argument('--sleep', type=float, default=10.0, help="Idle poll interval in seconds (--loop)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Print due emails with the console backend; nothing is sent or marked")
+
+    def handle(self, *args, **opts):
+        if opts['dry_run']:
+            due = list(OutboundEmail.objects.filter(
+                status=OutboundEmail.PENDING, next_attempt_at__lte=timezone.now())[:opts['batch']])
+            conn = get_connection('django.core.mail.backends.console.EmailBackend', stream=self.stdout)
+            conn.send_messages([emails._message(em) for em in due])
+            self.stdout.write(self.style.SUCCESS(f"{len(due)} emails due (dry run)"))
+            return
+        total_sent = total_failed = 0
+        try:
+            while True:
+                sent, failed = emails.send_outbox(opts['batch'])
+                total_sent += sent
+                total_failed += failed
+                if not (sent or failed):
+                    if not opts['loop']:
+                        break
+                    time.sleep(opts['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Sent {total_sent} emails, {total_failed} failed"))
@@ -0,0 +1,77 @@
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from shop import zipindex
+from shop.fees import _parse_fee_tiers
+from shop.models import DeliveryZone, DeliveryRate
+
+class Command(BaseCommand):
+    help = "Generate DeliveryZone/DeliveryRate rows for every US ZIP inside the distance tiers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-zip', default=None, help="Defaults to settings.STORE_ZIP")
+        parser.add_argument('--tiers', default=None, help='e.g. "5:3,10:5,25:8"; defaults to settings.DELIVERY_FEE_TIERS')
+        parser.add_argument('--max-miles', type=float, default=None, help="Cap below the largest tier")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--prune', action='store_true',
+                            help="Delete rates for ZIPs outside the tiers (checkout prefers a rate over the tiers)")
+        parser.add_argument('--dry-run', action='store_true', help="Print the diff without writing")
+
+    def handle(self, *args, **opts):
+        store_zip = opts['store_zip'] or settings.STORE_ZIP
+        tiers = _parse_fee_tiers(opts['tiers'] or settings.DELIVERY_FEE_TIERS)
+        if not tiers:
+            raise CommandError("No fee tiers given")
+        edges = np.array([m for m, _ in tiers])
+        fees = [fee.quantize(Decimal('0.01')) for _, fee in tiers]
+        limit = edges[-1] if opts['max_miles'] is None else min(edges[-1], opts['max_miles'])
+
+        try:
+            zips, miles = zipindex.distances_from(store_zip)
+        except KeyError as e:
+            raise CommandError(str(e))
+        inside = miles <= limit
+        tier_idx = np.searchsorted(edges, miles[inside], side='left')
+        wanted = {f"{z:05d}": fees[t] for z, t in zip(zips[inside].tolist(), tier_idx.tolist())}
+
+        existing = {r.postal_code: r for r in DeliveryRate.objects.only('id', 'postal_code', 'fee')}
+        zones = set(DeliveryZone.objects.values_list('postal_code', flat=True))
+        new_rates = [DeliveryRate(postal_code=z, fee=f) for z, f in wanted.items() if z not in existing]
+        changed = []
+        for z, f in wanted.items():
+            r = existing.get(z)
+            if r is not None and r.fee != f:
+                if opts['verbosity'] > 1 or opts['dry_run']:
+                    self.stdout.write(f"~ {z}: ${r.fee} -> ${f}")
+                r.fee = f
+                changed.append(r)
+        new_zones = [DeliveryZone(postal_code=z) for z in wanted if z not in zones]
+        outside = sorted(z for z in existing if z not in wanted)
+        if opts['verbosity'] > 1 or opts['dry_run']:
+            for r in new_rates:
+                self.stdout.write(f"+ {r.postal_code}: ${r.fee}")
+            for z in outside:
+                self.stdout.write(f"- {z}: ${existing[z].fee}")
+
+        summary = (f"{len(wanted)} ZIPs within {limit:g} mi of {store_zip}: "
+                   f"{len(new_rates)} new rates, {len(changed)} changed, "
+                   f"{len(wanted) - len(new_rates) - len(changed)} unchanged, {len(new_zones)} new zones, "
+                   f"{len(outside)} rates outside the tiers" + (" deleted" if opts['prune'] else " kept (use --prune)"))
+        if opts['dry_run']:
+            self.stdout.write(f"DRY-RUN: {summary}")
+            return
+
+        size = opts['chunk_size']
+        for i in range(0, max(len(new_rates), len(changed), len(new_zones)), size):
+            with transaction.atomic():
+                DeliveryZone.objects.bulk_create(new_zones[i:i+size], ignore_conflicts=True)
+                DeliveryRate.objects.bulk_create(new_rates[i:i+size], ignore_conflicts=True)
+                DeliveryRate.objects.bulk_update(changed[i:i+size], ['fee'])
+        if opts['prune']:
+            stale = [existing[z].id for z in outside]
+            for i in range(0, len(stale), size):
+                with transaction.atomic():
+                    DeliveryRate.objects.filter(id__in=stale[i:i+size]).delete()
+        self.stdout.write(self.style.SUCCESS(summary))
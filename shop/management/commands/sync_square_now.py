@@ -1,9 +1,23 @@
 from django.core.management.base import BaseCommand
+from shop import square_client
 from shop.square_sync import pull_catalog
 
 class Command(BaseCommand):
-    help = "Pull products and variations from Square and update the local catalog."
+    help = ("Pull products and variations from Square and update the local catalog. "
+            "Runs a delta sync, or a full reconcile when one is due.")
 
-    def handle(self, *args, **kwargs):
-        created, updated = pull_catalog()
-        self.stdout.write(self.style.SUCCESS(f"Square sync complete: {created} created, {updated} updated"))
+    def add_arguments(self, parser):
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--full', dest='mode', action='store_const', const='full',
+                          help="List the whole catalog and deactivate variations removed from Square")
+        mode.add_argument('--delta', dest='mode', action='store_const', const='delta',
+                          help="Only fetch objects changed since the last sync")
+
+    def handle(self, *args, **opts):
+        result = pull_catalog(opts['mode'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Square sync complete: {result.created} created, {result.updated} updated, "
+            f"{result.unchanged} unchanged, {result.deactivated} deactivated"))
+        for endpoint, s in sorted(square_client.stats().items()):
+            self.stdout.write(f"  {endpoint}: {s['calls']} calls, {s['errors']} errors, "
+                              f"avg {s['avg_ms']:.0f}ms, max {s['max_ms']:.0f}ms")
@@ -1,5 +1,9 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 
 class Category(models.Model):
     name = models.CharField(max_length=120, unique=True)
@@ -27,10 +31,35 @@ class Product(models.Model):
     square_variation_id = models.CharField(max_length=64, blank=True, default='')
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
-    class Meta: ordering = ['name']
+    class Meta:
+        ordering = ['name']
+        # Django renders filter(active=True) as a bare "WHERE active" on SQLite, which
+        # only partial indexes on the same condition can serve. See shop.tests.QueryPlanTests.
+        indexes = [
+            models.Index(fields=['name'], condition=Q(active=True), name='product_active_name_idx'),
+            models.Index(fields=['name'], condition=Q(active=True, featured=True), name='product_featured_idx'),
+            models.Index(fields=['-sales_count'], condition=Q(active=True), name='product_bestseller_idx'),
+            models.Index(fields=['category', 'name'], condition=Q(active=True), name='product_category_idx'),
+            models.Index(fields=['square_variation_id'], name='product_square_var_idx'),
+            models.Index(fields=['sku'], name='product_sku_idx'),
+            models.Index(fields=['upc'], name='product_upc_idx'),
+        ]
     def __str__(self): return self.name
     def get_absolute_url(self): return reverse('product', args=[self.slug])
 
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate calc_subtotal/calc_total summed from the items in SQL,
+        independent of the stored columns (for reporting and audits)."""
+        line = ExpressionWrapper(F('items__quantity') * F('items__price'), output_field=MONEY)
+        return self.annotate(
+            calc_subtotal=Coalesce(Sum(line), Value(Decimal('0.00')), output_field=MONEY),
+        ).annotate(
+            calc_total=ExpressionWrapper(F('calc_subtotal') - F('discount_amount') + F('delivery_fee'), output_field=MONEY),
+        )
+
 class Order(models.Model):
     FULFILLMENT = (('delivery','Delivery'),('pickup','Local Pickup'))
     customer_name = models.CharField(max_length=120)
@@ -48,10 +77,37 @@ class Order(models.Model):
     fulfillment_method = models.CharField(max_length=12, choices=FULFILLMENT, default='delivery')
     pickup_note = models.CharField(max_length=140, blank=True, default='')
     pickup_at = models.DateTimeField(blank=True, null=True)
-    class Meta: ordering = ['-created']
+    # Set from the Square payment link so webhooks resolve orders by equality lookup
+    square_payment_link_id = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    square_order_id = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Denormalized from the items; kept current by recalculate_totals()
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    grand_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Set in the same transaction as the paid-order side effect so a re-run job skips it
+    sales_recorded = models.BooleanField(default=False)
+    confirmation_queued = models.BooleanField(default=False)
+    objects = OrderQuerySet.as_manager()
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            models.Index(fields=['-created'], name='order_created_idx'),
+            models.Index(fields=['-created'], condition=Q(paid=True), name='order_paid_created_idx'),
+            models.Index(fields=['pickup_at', 'fulfillment_method'], name='order_pickup_at_idx'),
+        ]
     def __str__(self): return f"Order #{self.pk}"
     @property
-    def total(self): return sum(item.total for item in self.items.all())
+    def total(self): return self.subtotal
+    def save(self, *args, **kwargs):
+        self.grand_total = Decimal(self.subtotal) - Decimal(self.discount_amount) + Decimal(self.delivery_fee)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'subtotal', 'discount_amount', 'delivery_fee'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'grand_total'}
+        super().save(*args, **kwargs)
+    def recalculate_totals(self):
+        row = Order.objects.filter(pk=self.pk).with_totals().values('calc_subtotal', 'calc_total').first()
+        if row:
+            self.subtotal, self.grand_total = row['calc_subtotal'], row['calc_total']
+            Order.objects.filter(pk=self.pk).update(subtotal=self.subtotal, grand_total=self.grand_total)
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
@@ -99,3 +155,87 @@ class DeliveryRate(models.Model):
     postal_code = models.CharField(max_length=20, unique=True)
     fee = models.DecimalField(max_digits=6, decimal_places=2, default=0)
     def __str__(self): return f"{self.postal_code}: ${self.fee}"
+
+
+class SyncState(models.Model):
+    """Watermarks for incremental Square syncs, one row per feed (e.g. 'catalog')."""
+    name = models.CharField(max_length=40, unique=True)
+    synced_at = models.DateTimeField(blank=True, null=True)
+    full_synced_at = models.DateTimeField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
+    def __str__(self): return self.name
+
+
+class Job(models.Model):
+    """Durable background job, claimed and run by `manage.py run_worker`."""
+    PENDING='pending'; RUNNING='running'; DONE='done'; DEAD='dead'
+    STATUSES=[(PENDING,'Pending'), (RUNNING,'Running'), (DONE,'Done'), (DEAD,'Dead')]
+    kind = models.CharField(max_length=60)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=8)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True, default='')
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+    def __str__(self): return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class InventoryDeduction(models.Model):
+    """One order line waiting to be deducted from Square stock. Rows are claimed
+    into batches (batch_key) by shop.inventory.flush and marked sent afterwards, or
+    failed once Square has rejected their batch too many times."""
+    PENDING='pending'; CLAIMED='claimed'; SENT='sent'; FAILED='failed'
+    STATUSES=[(PENDING,'Pending'), (CLAIMED,'Claimed'), (SENT,'Sent'), (FAILED,'Failed')]
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='inventory_deductions')
+    square_variation_id = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    batch_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    class Meta:
+        ordering = ['id']
+        constraints = [models.UniqueConstraint(fields=['order', 'square_variation_id'], name='uniq_deduction_order_variation')]
+        indexes = [models.Index(fields=['status', 'created'])]
+    def __str__(self): return f"{self.square_variation_id} x{self.quantity} (order {self.order_id})"
+
+
+class WebhookEvent(models.Model):
+    """Ledger of processed Square webhook deliveries; the unique event_id makes retries no-ops."""
+    event_id = models.CharField(max_length=100, unique=True)
+    event_type = models.CharField(max_length=60, blank=True, default='')
+    order = models.ForeignKey(Order, blank=True, null=True, on_delete=models.SET_NULL, related_name='webhook_events')
+    received = models.DateTimeField(auto_now_add=True)
+    def __str__(self): return self.event_id
+
+
+class OutboundEmail(models.Model):
+    """Pre-rendered email waiting for `manage.py send_outbox`; one row per recipient."""
+    PENDING='pending'; SENDING='sending'; SENT='sent'; FAILED='failed'
+    STATUSES=[(PENDING,'Pending'), (SENDING,'Sending'), (SENT,'Sent'), (FAILED,'Failed')]
+    order = models.ForeignKey(Order, blank=True, null=True, on_delete=models.SET_NULL, related_name='emails')
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.CharField(max_length=254)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True, default='')
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+    def __str__(self): return f"{self.subject} -> {self.to}"
@@ -0,0 +1,116 @@
+"""Checkout pipeline: cart -> Order + OrderItems with stock reserved, in one
+transaction and a fixed number of queries whatever the cart size."""
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .catalog_cache import bump_catalog_version
+from .db import immediate_atomic
+from .fees import compute_tiered_fee
+from .models import DeliveryRate, Order, OrderItem, Product, PromoCode
+from .pickup import slot_has_room
+
+CENTS = Decimal('0.01')
+
+
+class CheckoutError(Exception):
+    """The order could not be placed; the message is safe to show the customer."""
+
+
+def _claim_promo(code, subtotal):
+    code = (code or '').strip()
+    if not code:
+        return '', Decimal('0.00')
+    now = timezone.now()
+    promo = PromoCode.objects.filter(code__iexact=code, active=True).first()
+    if (not promo or (promo.starts and promo.starts > now) or (promo.ends and promo.ends < now)):
+        raise CheckoutError(f"Promo code {code} is not valid.")
+    # Count the use atomically so a limit can't be overshot by concurrent checkouts.
+    claimed = (PromoCode.objects.filter(pk=promo.pk)
+               .filter(Q(usage_limit__isnull=True) | Q(usage_count__lt=F('usage_limit')))
+               .update(usage_count=F('usage_count') + 1))
+    if not claimed:
+        raise CheckoutError(f"Promo code {promo.code} has been fully redeemed.")
+    if promo.discount_type == PromoCode.PERCENT:
+        discount = subtotal * promo.value / Decimal(100)
+    else:
+        discount = promo.value
+    return promo.code, min(discount, subtotal).quantize(CENTS)
+
+
+def _delivery_fee(zip_code, taxable):
+    rate = DeliveryRate.objects.filter(postal_code=zip_code).first()
+    if rate:
+        fee = Decimal(rate.fee)
+    else:
+        fee = compute_tiered_fee(settings.STORE_ZIP, zip_code, settings.DELIVERY_FEE_TIERS)
+    threshold = getattr(settings, 'FREE_DELIVERY_THRESHOLD', Decimal('0'))
+    if threshold and taxable >= threshold:
+        fee = Decimal('0.00')
+    return fee.quantize(CENTS)
+
+
+def _reserve_stock(qty_by_id, products):
+    """Decrement stock for every line in one conditional UPDATE; any line short
+    on stock leaves the row count short and aborts the transaction."""
+    cond = reduce(or_, (Q(id=pid, stock__gte=qty) for pid, qty in qty_by_id.items()))
+    reserved = Product.objects.filter(cond).update(stock=Case(
+        *(When(id=pid, then=F('stock') - qty) for pid, qty in qty_by_id.items()),
+        output_field=PositiveIntegerField(),
+    ))
+    if reserved != len(qty_by_id):
+        short = [p for pid, p in products.items() if p.stock < qty_by_id[pid]]
+        if short:
+            p = short[0]
+            raise CheckoutError(f"Sorry, only {p.stock} of {p.name} left in stock.")
+        raise CheckoutError("Some items just sold out. Please review your cart.")
+
+
+@immediate_atomic()
+def place_order(data, cart):
+    """Create a paid-pending Order from CheckoutForm.cleaned_data and a session cart
+    ({product_id: qty}). Raises CheckoutError; nothing is written on failure."""
+    qty_by_id = {int(pid): int(qty) for pid, qty in cart.items() if int(qty) > 0}
+    if not qty_by_id:
+        raise CheckoutError("Your cart is empty.")
+    products = Product.objects.filter(active=True).in_bulk(list(qty_by_id))
+    if len(products) != len(qty_by_id):
+        raise CheckoutError("Some items in your cart are no longer available.")
+
+    subtotal = sum((p.price * qty_by_id[pid] for pid, p in products.items()), Decimal('0.00'))
+    promo_code, discount = _claim_promo(data.get('promo_code'), subtotal)
+
+    fulfillment = data.get('fulfillment_method') or 'delivery'
+    delivery_fee = Decimal('0.00')
+    pickup_at = None
+    if fulfillment == 'delivery':
+        delivery_fee = _delivery_fee(data.get('zip_code', '').strip(), subtotal - discount)
+    elif data.get('pickup_slot'):
+        pickup_at = parse_datetime(data['pickup_slot'])
+        if pickup_at is None or not slot_has_room(pickup_at):
+            raise CheckoutError("That pickup time just filled up. Please pick another.")
+
+    order = Order.objects.create(
+        customer_name=data['name'], email=data['email'], address=data['address'],
+        city=data['city'], state=data['state'], zip_code=data['zip_code'],
+        promo_code=promo_code, discount_amount=discount, delivery_fee=delivery_fee,
+        fulfillment_method=fulfillment, pickup_note=data.get('pickup_note', ''),
+        pickup_at=pickup_at, subtotal=subtotal,
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=p, quantity=qty_by_id[pid], price=p.price,
+                  sku=p.sku, upc=p.upc, allergens=p.allergens)
+        for pid, p in products.items()
+    ])
+    _reserve_stock(qty_by_id, products)
+    # Stock counts on cached pages may lag by STOREFRONT_CACHE_SECONDS; only a sell-out
+    # retires the catalog caches (queryset updates skip the signals that would).
+    if any(p.stock <= qty_by_id[pid] for pid, p in products.items()):
+        transaction.on_commit(bump_catalog_version)
+    return order
@@ -0,0 +1,80 @@
+"""Pickup slot engine.
+
+The weekly slot template is built from PickupWindow rows once and cached until
+a window changes; bookings for the whole horizon come from one aggregate query.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Order, PickupWindow
+
+SLOT_MINUTES = 30
+TEMPLATE_KEY = 'pickup:template'
+
+
+def weekly_template():
+    """{weekday: [slot start times]} for every PickupWindow. A window whose end is at or
+    before its start (e.g. 18:00-00:00) runs until midnight."""
+    tpl = cache.get(TEMPLATE_KEY)
+    if tpl is None:
+        starts = {d: set() for d in range(7)}
+        for w in PickupWindow.objects.all():
+            cur = w.start.hour * 60 + w.start.minute
+            end = w.end.hour * 60 + w.end.minute
+            if end <= cur:
+                end = 24 * 60
+            while cur + SLOT_MINUTES <= end:
+                starts[w.weekday % 7].add(time(cur // 60, cur % 60))
+                cur += SLOT_MINUTES
+        tpl = {d: sorted(t) for d, t in starts.items()}
+        cache.set(TEMPLATE_KEY, tpl, None)
+    return tpl
+
+
+def invalidate_template():
+    cache.delete(TEMPLATE_KEY)
+
+
+def booked_counts(start, end):
+    """{pickup_at: number of orders} for pickups in [start, end)."""
+    rows = (Order.objects
+            .filter(fulfillment_method='pickup', pickup_at__gte=start, pickup_at__lt=end)
+            .values('pickup_at').annotate(n=Count('id')).order_by())
+    return {r['pickup_at']: r['n'] for r in rows}
+
+
+def _capacity():
+    return getattr(settings, 'PICKUP_SLOT_CAPACITY', 0)
+
+
+def available_slots(now_local, days=2):
+    """[(label, iso)] of future slots with room left, for today and the next days-1."""
+    tpl = weekly_template()
+    candidates = []
+    for day_offset in range(days):
+        day = now_local.date() + timedelta(days=day_offset)
+        for t in tpl[day.weekday()]:
+            cur = timezone.make_aware(datetime.combine(day, t))
+            if cur > now_local:
+                candidates.append(cur)
+    if not candidates:
+        return []
+
+    capacity = _capacity()
+    if capacity:
+        booked = booked_counts(candidates[0], candidates[-1] + timedelta(minutes=SLOT_MINUTES))
+        candidates = [c for c in candidates if booked.get(c, 0) < capacity]
+    return [(c.strftime('%a %b %d, %I:%M %p'), c.isoformat()) for c in candidates]
+
+
+def slot_has_room(slot_at):
+    """Re-check one slot at booking time (call inside the checkout transaction)."""
+    capacity = _capacity()
+    if not capacity:
+        return True
+    booked = Order.objects.filter(fulfillment_method='pickup', pickup_at=slot_at).count()
+    return booked < capacity
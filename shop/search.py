@@ -0,0 +1,121 @@
+"""Full-text product search.
+
+On SQLite, active products are mirrored into an FTS5 table keyed by Product id
+and ranked with bm25. Other backends fall back to icontains filters.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Product
+
+FTS_TABLE = 'shop_product_fts'
+# bm25 column weights: name, description, sku, upc, category
+WEIGHTS = (10.0, 1.0, 4.0, 4.0, 2.0)
+_CHUNK = 500
+
+
+def enabled():
+    return connection.vendor == 'sqlite'
+
+
+def ensure_index():
+    if not enabled():
+        return
+    with connection.cursor() as cur:
+        cur.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, description, sku, upc, category, "
+            "tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+
+def _delete(cur, ids):
+    for i in range(0, len(ids), _CHUNK):
+        chunk = ids[i:i+_CHUNK]
+        cur.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({','.join('%s' for _ in chunk)})", chunk)
+
+
+def index_products(ids=None):
+    """(Re)index the given product ids, or the whole catalog when ids is None.
+    Inactive products are dropped from the index."""
+    if not enabled():
+        return
+    qs = Product.objects.filter(active=True)
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return
+        qs = qs.filter(id__in=ids)
+    rows = list(qs.values_list('id', 'name', 'description', 'sku', 'upc', 'category__name'))
+    # one transaction: in autocommit SQLite would commit (and fsync) every row
+    with transaction.atomic(), connection.cursor() as cur:
+        if ids is None:
+            cur.execute(f"DELETE FROM {FTS_TABLE}")
+        else:
+            _delete(cur, ids)
+        cur.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, sku, upc, category) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [(pk, name, desc or '', sku or '', upc or '', cat or '') for pk, name, desc, sku, upc, cat in rows],
+        )
+
+
+def remove_products(ids):
+    if not enabled():
+        return
+    with connection.cursor() as cur:
+        _delete(cur, list(ids))
+
+
+def match_expression(q):
+    """Every word must match, each as a prefix: 'sour patch' -> '"sour"* "patch"*'."""
+    return ' '.join(f'"{t}"*' for t in re.findall(r'\w+', q.lower()))
+
+
+class RankedResults:
+    """Lazy, sliceable bm25-ranked result set, so Django's Paginator can page it
+    with one COUNT and one LIMIT/OFFSET query per page."""
+
+    def __init__(self, expr):
+        self.expr = expr
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            with connection.cursor() as cur:
+                cur.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [self.expr])
+                self._count = cur.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            return self[k:k+1][0]
+        start = k.start or 0
+        limit = -1 if k.stop is None else max(0, k.stop - start)
+        weights = ', '.join(str(w) for w in WEIGHTS)
+        with connection.cursor() as cur:
+            cur.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s OFFSET %s",
+                [self.expr, limit, start],
+            )
+            ids = [r[0] for r in cur.fetchall()]
+        by_id = Product.objects.filter(active=True).in_bulk(ids)
+        return [by_id[i] for i in ids if i in by_id]
+
+
+def search_products(q):
+    """Ranked products matching q across name, description, SKU, UPC and category."""
+    if enabled():
+        expr = match_expression(q)
+        return RankedResults(expr) if expr else Product.objects.none()
+    return Product.objects.filter(
+        Q(name__icontains=q) | Q(description__icontains=q) | Q(sku__icontains=q)
+        | Q(upc__icontains=q) | Q(category__name__icontains=q),
+        active=True,
+    ).order_by('-sales_count', 'name')
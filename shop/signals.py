@@ -0,0 +1,47 @@
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .models import Category, Product, PromoCode, PickupWindow, OrderItem
+from .catalog_cache import bump_catalog_version
+from .pickup import invalidate_template
+from . import search, suggest
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=PromoCode)
+def catalog_changed(sender, **kwargs):
+    # after commit, or a request in between would cache the old rows under the new version
+    transaction.on_commit(bump_catalog_version)
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_products([instance.pk])
+    # queued after catalog_changed's bump, so the suggest index can follow the version
+    transaction.on_commit(lambda: suggest.product_saved(instance))
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+    transaction.on_commit(lambda: suggest.product_deleted(instance.pk))
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    if not created:
+        search.index_products(instance.products.values_list('id', flat=True))
+
+@receiver(post_migrate)
+def build_search_index(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    # shop ships no migrations, so its tables may not exist yet (or were just
+    # migrated away); rebuild_search_index fills the index once they do
+    if sender.name != 'shop' or Product._meta.db_table not in connections[using].introspection.table_names():
+        return
+    search.ensure_index()
+    search.index_products()
+
+@receiver([post_save, post_delete], sender=PickupWindow)
+def pickup_windows_changed(sender, **kwargs):
+    invalidate_template()
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def order_items_changed(sender, instance, **kwargs):
+    instance.order.recalculate_totals()
@@ -0,0 +1,90 @@
+"""One Square API client per process, shared by checkout and the sync code.
+
+The client, and with it the HTTP session and its keep-alive connections, is
+built once per (environment, token) with timeouts from settings. Every call
+through it is timed per endpoint ("catalog.list_catalog", ...); see stats().
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+try:
+    from square.client import Client
+except Exception:
+    Client = None
+
+log = logging.getLogger(__name__)
+
+SLOW_MS = 2000
+_clients = {}
+_clients_lock = threading.Lock()
+_stats = defaultdict(lambda: {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+_stats_lock = threading.Lock()
+
+
+def _record(endpoint, ms, error):
+    with _stats_lock:
+        s = _stats[endpoint]
+        s['calls'] += 1
+        s['errors'] += error
+        s['total_ms'] += ms
+        s['max_ms'] = max(s['max_ms'], ms)
+    if error or ms > SLOW_MS:
+        log.warning("Square %s %s in %.0fms", endpoint, "failed" if error else "slow", ms)
+
+
+def stats():
+    """{endpoint: {calls, errors, total_ms, max_ms, avg_ms}} for this process."""
+    with _stats_lock:
+        return {k: dict(v, avg_ms=v['total_ms'] / v['calls']) for k, v in _stats.items() if v['calls']}
+
+
+class _TimedApi:
+    def __init__(self, name, api):
+        self._name, self._api = name, api
+
+    def __getattr__(self, attr):
+        fn = getattr(self._api, attr)
+        if not callable(fn):
+            return fn
+        endpoint = f"{self._name}.{attr}"
+
+        def call(*args, **kwargs):
+            start, error = time.perf_counter(), True
+            try:
+                result = fn(*args, **kwargs)
+                error = bool(result.is_error()) if hasattr(result, 'is_error') else False
+                return result
+            finally:
+                _record(endpoint, (time.perf_counter() - start) * 1000, error)
+        return call
+
+
+class _TimedClient:
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return _TimedApi(name, getattr(self._client, name))
+
+
+def get_client():
+    if not Client:
+        raise RuntimeError("Square SDK not installed. Run: pip install squareup")
+    token = settings.SQUARE_ACCESS_TOKEN
+    if not token:
+        raise RuntimeError("Missing SQUARE_ACCESS_TOKEN")
+    env = "production" if settings.SQUARE_ENV.lower() == "production" else "sandbox"
+    client = _clients.get((env, token))
+    if client is None:
+        with _clients_lock:
+            client = _clients.get((env, token))
+            if client is None:
+                client = _clients[(env, token)] = _TimedClient(Client(
+                    access_token=token, environment=env,
+                    timeout=(settings.SQUARE_CONNECT_TIMEOUT, settings.SQUARE_READ_TIMEOUT),
+                ))
+    return client
@@ -1,18 +1,7 @@
 import os
 from decimal import Decimal
-try:
-    from square.client import Client
-except Exception:
-    Client = None
-
-def get_client():
-    if not Client:
-        raise RuntimeError("Square SDK not installed. Run: pip install squareup")
-    env = os.getenv("SQUARE_ENV", "sandbox")
-    token = os.getenv("SQUARE_ACCESS_TOKEN", "")
-    if not token:
-        raise RuntimeError("Missing SQUARE_ACCESS_TOKEN")
-    return Client(access_token=token, environment="production" if env.lower()=="production" else "sandbox")
+from .models import Order
+from .square_client import get_client
 
 def create_payment_link(order_id: int, amount: Decimal, currency="USD", note="Auntie Jummy’s order"):
     client = get_client()
@@ -28,5 +17,8 @@ def create_payment_link(order_id: int, amount: Decimal, currency="USD", note="Au
     }
     result = client.payment_links.create_payment_link(body)
     if result.is_success():
-        return result.body["payment_link"]["url"]
+        link = result.body["payment_link"]
+        Order.objects.filter(id=order_id).update(
+            square_payment_link_id=link.get("id", ""), square_order_id=link.get("order_id", ""))
+        return link["url"]
     raise RuntimeError(str(result.errors))
@@ -1,117 +1,305 @@
 import os
+import uuid
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
 from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.text import slugify
-from .models import Category, Product
-
-try:
-    from square.client import Client
-except Exception:
-    Client = None
-
-def _client():
-    if not Client:
-        raise RuntimeError("Square SDK not installed. Run: pip install squareup")
-    token = os.getenv("SQUARE_ACCESS_TOKEN","")
-    env = os.getenv("SQUARE_ENV","sandbox").lower()
-    if not token:
-        raise RuntimeError("Missing SQUARE_ACCESS_TOKEN")
-    return Client(access_token=token, environment="production" if env=="production" else "sandbox")
-
-def fetch_inventory_counts():
-    client = _client()
-    try:
-        res = client.inventory.batch_retrieve_counts(body={"location_ids": []})
+from .catalog_cache import bump_catalog_version
+from .models import Category, Product, SyncState
+from .square_client import get_client as _client
+from . import catalog_snapshot, search
+
+INVENTORY_CHUNK = 500
+INVENTORY_WORKERS = 4
+
+def _count_pages(client, body):
+    """Follow the cursor through every page of one batch_retrieve_counts request."""
+    counts = defaultdict(int)
+    cursor = None
+    while True:
+        res = client.inventory.batch_retrieve_counts(body=dict(body, cursor=cursor) if cursor else body)
         if res.is_error():
-            return {}
-        counts = {}
+            raise RuntimeError(f"Square inventory counts failed: {res.errors}")
         for c in res.body.get("counts", []):
-            oid = c.get("catalog_object_id")
-            qty = c.get("quantity")
-            if oid and qty is not None:
-                try:
-                    counts[oid] = int(float(qty))
-                except Exception:
-                    pass
-        return counts
-    except Exception:
-        return {}
-
-@transaction.atomic
-def pull_catalog():
+            oid, qty = c.get("catalog_object_id"), c.get("quantity")
+            if oid and qty is not None and c.get("state", "IN_STOCK") == "IN_STOCK":
+                counts[oid] += int(float(qty))
+        cursor = res.body.get("cursor")
+        if not cursor:
+            return counts
+
+def fetch_inventory_counts(variation_ids=None, updated_after=None, workers=INVENTORY_WORKERS):
+    """IN_STOCK quantity by variation id, summed over SQUARE_INVENTORY_LOCATION_IDS,
+    optionally limited to some variation ids and/or counts changed after
+    `updated_after`. Requests are split per location and per chunk of ids and run
+    concurrently. API errors raise RuntimeError: partial counts would look like
+    real stock levels."""
     client = _client()
-    cursor = None
-    items = {}
-    variations = []
-    created = updated = 0
+    base = {"states": ["IN_STOCK"]}
+    if updated_after:
+        base["updated_after"] = updated_after.isoformat()
+    locations = [[l] for l in settings.SQUARE_INVENTORY_LOCATION_IDS] or [None]
+    if variation_ids is None:
+        id_chunks = [None]
+    else:
+        ids = sorted(set(v for v in variation_ids if v))
+        if not ids:
+            return {}
+        id_chunks = [ids[i:i+INVENTORY_CHUNK] for i in range(0, len(ids), INVENTORY_CHUNK)]
+    bodies = []
+    for loc in locations:
+        for chunk in id_chunks:
+            body = dict(base)
+            if loc:
+                body["location_ids"] = loc
+            if chunk:
+                body["catalog_object_ids"] = chunk
+            bodies.append(body)
+
+    counts = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(bodies)))) as pool:
+        for part in pool.map(lambda b: _count_pages(client, b), bodies):
+            for oid, qty in part.items():
+                counts[oid] += qty
+    if updated_after and len(locations) > 1:
+        # a change at one location only reports that location; re-read the totals
+        return fetch_inventory_counts(list(counts), workers=workers)
+    return dict(counts)
+
+SyncResult = namedtuple('SyncResult', 'created updated unchanged deactivated', defaults=(0,))
+DEFAULT_CATEGORY = "Candy & Snacks"
+CHUNK = 500
+LOCK_KEY = 'square:catalog-sync:lock'
+# Re-read a little before the watermark; re-applying unchanged objects writes nothing
+OVERLAP = timedelta(minutes=5)
+
+def _variation_row(var, items):
+    """(variation id, full name, slug, price, category name) for an ITEM_VARIATION object."""
+    vdata = var.get("item_variation_data", {})
+    item = items.get(vdata.get("item_id"), {})
+    name = (item.get("item_data", {}).get("name") or "Square Item").strip()
+    full_name = f"{name} {vdata.get('name') or ''}".strip()
+    price = Decimal("0.00")
+    pm = vdata.get("price_money")
+    if pm and pm.get("amount") is not None:
+        price = Decimal(pm["amount"]) / Decimal(100)
+    cat_name = item.get("item_data", {}).get("category_id") or DEFAULT_CATEGORY
+    return var.get("id", ""), full_name, slugify(full_name)[:200], price, cat_name
+
+def _categories(names):
+    cats = {c.name: c for c in Category.objects.filter(name__in=names)}
+    for name in set(names) - set(cats):
+        cats[name], _ = Category.objects.get_or_create(name=name, defaults={"slug": slugify(name)})
+    return cats
+
+def _existing(var_ids, slugs):
+    found = {}
+    var_ids = [v for v in var_ids if v]
+    for lookup, values in (("square_variation_id__in", var_ids), ("slug__in", slugs)):
+        for i in range(0, len(values), CHUNK):
+            for p in Product.objects.filter(**{lookup: values[i:i+CHUNK]}):
+                found[p.pk] = p
+    return found.values()
+
+def apply_catalog(items, variations, inv_counts, dead=()):
+    """Upsert Products for Square variations with a handful of queries: existing rows
+    are loaded up front, diffed in memory, and written back with bulk_create /
+    bulk_update (changed fields only) in chunked transactions. Products for the
+    variation ids in `dead` are deactivated."""
+    rows = [_variation_row(var, items) for var in variations]
+    cats = _categories({r[4] for r in rows})
+    existing = _existing([r[0] for r in rows] + list(inv_counts), [r[2] for r in rows])
+    by_var = {p.square_variation_id: p for p in existing if p.square_variation_id}
+    by_slug = {p.slug: p for p in existing}
+
+    new, dirty, seen = {}, {}, set()
+    for var_id, full_name, slug, price, cat_name in rows:
+        prod = by_var.get(var_id) or by_slug.get(slug) or new.get(slug)
+        if prod is None:
+            new[slug] = Product(slug=slug, name=full_name, category=cats[cat_name], price=price,
+                                stock=max(0, int(inv_counts.get(var_id, 50))), active=True,
+                                square_variation_id=var_id)
+            continue
+        wanted = {"name": full_name, "category_id": cats[cat_name].id, "square_variation_id": var_id}
+        if price > 0:
+            wanted["price"] = price
+        # Update stock from inventory if we have a count keyed by this variation id
+        if var_id in inv_counts:
+            wanted["stock"] = max(0, int(inv_counts[var_id]))
+        changed = {f for f, v in wanted.items() if getattr(prod, f) != v}
+        for f in changed:
+            setattr(prod, f, wanted[f])
+        if prod.pk:
+            seen.add(prod.pk)
+            if changed:
+                dirty.setdefault(prod.pk, (prod, set()))[1].update(changed)
+    # counts that moved for variations whose catalog object did not (delta syncs)
+    row_vars = {r[0] for r in rows}
+    for var_id, qty in inv_counts.items():
+        prod = by_var.get(var_id)
+        if prod is None or var_id in row_vars or prod.stock == max(0, int(qty)):
+            continue
+        prod.stock = max(0, int(qty))
+        seen.add(prod.pk)
+        dirty.setdefault(prod.pk, (prod, set()))[1].add("stock")
+
+    now = timezone.now()
+    groups = defaultdict(list)
+    for prod, fields in dirty.values():
+        prod.updated = now  # bulk_update skips auto_now
+        groups[tuple(sorted(fields)) + ("updated",)].append(prod)
+    created = list(new.values())
+    for i in range(0, len(created), CHUNK):
+        with transaction.atomic():
+            Product.objects.bulk_create(created[i:i+CHUNK])
+    for fields, prods in groups.items():
+        for i in range(0, len(prods), CHUNK):
+            with transaction.atomic():
+                Product.objects.bulk_update(prods[i:i+CHUNK], fields)
+
+    deactivated = []
+    dead = [v for v in dead if v]
+    for i in range(0, len(dead), CHUNK):
+        with transaction.atomic():
+            ids = list(Product.objects.filter(active=True, square_variation_id__in=dead[i:i+CHUNK])
+                       .values_list('id', flat=True))
+            Product.objects.filter(id__in=ids).update(active=False, updated=now)
+        deactivated += ids
 
+    # bulk writes skip the post_save signals that maintain search and caches
+    changed_ids = [p.pk for p in created] + list(dirty) + deactivated
+    if changed_ids:
+        search.index_products(changed_ids)
+        transaction.on_commit(bump_catalog_version)
+    transaction.on_commit(catalog_snapshot.rebuild)
+    return SyncResult(len(created), len(dirty), len(seen) - len(dirty), len(deactivated))
+
+def _list_catalog(client):
+    cursor = None
+    objects = []
     while True:
         res = client.catalog.list_catalog(cursor=cursor, types="ITEM,ITEM_VARIATION")
         if res.is_error():
             raise RuntimeError(str(res.errors))
-        result = res.body
-        for obj in result.get("objects", []):
-            if obj["type"] == "ITEM":
-                items[obj["id"]] = obj
-            elif obj["type"] == "ITEM_VARIATION":
-                variations.append(obj)
-        cursor = result.get("cursor")
+        objects.extend(res.body.get("objects", []))
+        cursor = res.body.get("cursor")
         if not cursor:
-            break
-
-    inv_counts = fetch_inventory_counts()
-
-    for var in variations:
-        vdata = var.get("item_variation_data", {})
-        item_id = vdata.get("item_id")
-        item = items.get(item_id, {})
-        name = (item.get("item_data", {}).get("name") or "Square Item").strip()
-        vname = vdata.get("name") or ""
-        full_name = f"{name} {vname}".strip()
-        price = Decimal("0.00")
-        pm = vdata.get("price_money")
-        if pm and pm.get("amount") is not None:
-            price = Decimal(pm["amount"]) / Decimal(100)
-
-        cat_name = item.get("item_data", {}).get("category_id") or "Candy & Snacks"
-        category, _ = Category.objects.get_or_create(name=cat_name, defaults={"slug": slugify(cat_name)})
-        slug = slugify(full_name)[:200]
-
-        prod, created_flag = Product.objects.get_or_create(slug=slug, defaults={
-            "name": full_name,
-            "category": category,
-            "price": price,
-            "stock": 50,
-            "active": True,
-            "square_variation_id": var.get("id",""),
-        })
-        # Update stock from inventory if we have a count keyed by this variation id
-        var_id = var.get('id')
-        if var_id in inv_counts:
-            prod.stock = max(0, int(inv_counts[var_id]))
-        if not created_flag:
-            changed = False
-            if prod.name != full_name:
-                prod.name = full_name; changed = True
-            if prod.category_id != category.id:
-                prod.category = category; changed = True
-            if price > 0 and prod.price != price:
-                prod.price = price; changed = True
-            if prod.square_variation_id != var_id:
-                prod.square_variation_id = var_id; changed = True
-            if changed:
-                prod.save()
-                updated += 1
-            else:
-                prod.save()
+            return objects
+
+def _search_changes(client, begin_time):
+    """ITEM/ITEM_VARIATION objects changed or deleted since begin_time, plus Square's
+    latest_time to use as the next watermark."""
+    cursor = latest = None
+    objects = []
+    while True:
+        body = {"object_types": ["ITEM", "ITEM_VARIATION"], "include_deleted_objects": True,
+                "begin_time": begin_time.isoformat()}
+        if cursor:
+            body["cursor"] = cursor
+        res = client.catalog.search_catalog_objects(body=body)
+        if res.is_error():
+            raise RuntimeError(str(res.errors))
+        objects.extend(res.body.get("objects", []))
+        latest = res.body.get("latest_time") or latest
+        cursor = res.body.get("cursor")
+        if not cursor:
+            return objects, latest
+
+def _retrieve(client, ids):
+    ids = list(ids)
+    found = []
+    for i in range(0, len(ids), 1000):
+        res = client.catalog.batch_retrieve_catalog_objects(body={"object_ids": ids[i:i+1000]})
+        if res.is_error():
+            raise RuntimeError(str(res.errors))
+        found.extend(res.body.get("objects", []))
+    return found
+
+def _split(objects):
+    """Items and variations by id; variations embedded in items count too."""
+    items, variations = {}, {}
+    for obj in objects:
+        if obj["type"] == "ITEM":
+            items[obj["id"]] = obj
+            for v in obj.get("item_data", {}).get("variations", []):
+                variations.setdefault(v["id"], v)
+        elif obj["type"] == "ITEM_VARIATION":
+            variations[obj["id"]] = obj
+    return items, variations
+
+def _partition(items, variations):
+    """(live variations, dead variation ids): deleted variations and those of
+    deleted or archived items are dead."""
+    live, dead = [], set()
+    for vid, var in variations.items():
+        item = items.get(var.get("item_variation_data", {}).get("item_id")) or {}
+        if var.get("is_deleted") or item.get("is_deleted") or item.get("item_data", {}).get("is_archived"):
+            dead.add(vid)
         else:
-            prod.save()
-            created += 1
+            live.append(var)
+    return live, dead
 
-    return created, updated
+@contextmanager
+def _sync_lock(timeout=900):
+    token = uuid.uuid4().hex
+    if not cache.add(LOCK_KEY, token, timeout):
+        raise RuntimeError("A Square catalog sync is already running")
+    try:
+        yield
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
 
-def push_inventory_deduction(items, reason="SALE"):  # items: list of (square_variation_id, quantity)
-    client = _client()
+def pull_catalog(mode=None):
+    """Sync products from Square. 'delta' fetches only objects changed since the last
+    sync; 'full' lists the whole catalog and also deactivates variations that are
+    gone from Square. By default a delta runs unless the last full reconcile is
+    older than SQUARE_FULL_SYNC_HOURS."""
+    with _sync_lock():
+        state, _ = SyncState.objects.get_or_create(name="catalog")
+        started = timezone.now()
+        if mode is None:
+            recent = state.full_synced_at and state.full_synced_at > started - timedelta(hours=settings.SQUARE_FULL_SYNC_HOURS)
+            mode = "delta" if state.synced_at and recent else "full"
+        if mode == "delta" and not state.synced_at:
+            raise RuntimeError("No previous sync to continue from; run a full sync first")
+        client = _client()
+
+        latest = None
+        if mode == "full":
+            items, variations = _split(_list_catalog(client))
+            live, dead = _partition(items, variations)
+            synced = set(Product.objects.filter(active=True).exclude(square_variation_id="")
+                         .values_list("square_variation_id", flat=True))
+            dead |= synced - set(variations)
+        else:
+            objects, latest = _search_changes(client, state.synced_at - OVERLAP)
+            items, variations = _split(objects)
+            parents = {v.get("item_variation_data", {}).get("item_id")
+                       for v in variations.values() if not v.get("is_deleted")}
+            items.update(_split(_retrieve(client, parents - set(items) - {None}))[0])
+            live, dead = _partition(items, variations)
+
+        counts = fetch_inventory_counts(updated_after=None if mode == "full" else state.synced_at - OVERLAP)
+        result = apply_catalog(items, live, counts, dead)
+        state.synced_at = (latest and parse_datetime(latest)) or started
+        if mode == "full":
+            state.full_synced_at = started
+        state.save()
+    return result
+
+BATCH_CHANGE_LIMIT = 100  # Square's max changes per batch_change_inventory call
+
+def push_inventory_deduction(items, reason="SALE", idempotency_key=None):  # items: list of (square_variation_id, quantity)
+    """Send one batch_change_inventory call. Pass a deterministic idempotency_key so
+    a retried call can't deduct twice (see shop.inventory)."""
     changes = []
     for var_id, qty in items:
         if not var_id or qty <= 0:
@@ -129,7 +317,10 @@ def push_inventory_deduction(items, reason="SALE"):  # items: list of (square_va
         })
     if not changes:
         return {"skipped": True}
-    body = {"idempotency_key": "inv-adjust-" + os.urandom(6).hex(), "changes": changes}
+    if len(changes) > BATCH_CHANGE_LIMIT:
+        raise ValueError(f"At most {BATCH_CHANGE_LIMIT} inventory changes per call")
+    client = _client()
+    body = {"idempotency_key": idempotency_key or "inv-adjust-" + os.urandom(6).hex(), "changes": changes}
     res = client.inventory.batch_change_inventory(body)
     if res.is_error():
         raise RuntimeError(str(res.errors))
@@ -0,0 +1,118 @@
+"""In-process typeahead index over active product names, SKUs and UPCs.
+
+A sorted list of (key, product_id) pairs is searched with bisect. Saves in this
+process update it in place; other workers see the catalog version move and
+rebuild on their next lookup.
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+from .catalog_cache import catalog_version
+from .models import Product
+
+MAX_SCAN = 2000
+_FIELDS = ('id', 'name', 'slug', 'price', 'sku', 'upc', 'sales_count')
+
+
+def _keys_for(name, sku, upc):
+    words = name.lower().split()
+    # every word start, so "fuego" finds "Takis Fuego ..."
+    keys = {' '.join(words[i:]) for i in range(len(words))}
+    keys.update(k.strip().lower() for k in (sku, upc) if k and k.strip())
+    return keys
+
+
+class SuggestIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.keys_by_id = {}
+        self.products = {}
+        self.version = None
+
+    def _add(self, row):
+        pid = row['id']
+        keys = _keys_for(row['name'], row['sku'], row['upc'])
+        self.keys_by_id[pid] = keys
+        self.products[pid] = {
+            'id': pid, 'name': row['name'], 'slug': row['slug'],
+            'price': str(row['price']), 'sales_count': row['sales_count'],
+        }
+        return [(k, pid) for k in keys]
+
+    def _remove(self, pid):
+        for k in self.keys_by_id.pop(pid, ()):
+            i = bisect_left(self.entries, (k, pid))
+            if i < len(self.entries) and self.entries[i] == (k, pid):
+                del self.entries[i]
+        self.products.pop(pid, None)
+
+    def rebuild(self, version):
+        rows = Product.objects.filter(active=True).values(*_FIELDS)
+        with self.lock:
+            self.entries, self.keys_by_id, self.products = [], {}, {}
+            for row in rows:
+                self.entries.extend(self._add(row))
+            self.entries.sort()
+            self.version = version
+
+    def upsert(self, product):
+        with self.lock:
+            self._remove(product.pk)
+            if product.active:
+                row = {f: getattr(product, f) for f in _FIELDS}
+                for entry in self._add(row):
+                    insort(self.entries, entry)
+
+    def remove(self, pid):
+        with self.lock:
+            self._remove(pid)
+
+    def lookup(self, prefix, limit):
+        with self.lock:
+            ids = set()
+            i = bisect_left(self.entries, (prefix,))
+            end = min(len(self.entries), i + MAX_SCAN)
+            while i < end and self.entries[i][0].startswith(prefix):
+                ids.add(self.entries[i][1])
+                i += 1
+            top = heapq.nlargest(limit, (self.products[pid] for pid in ids),
+                                 key=lambda p: (p['sales_count'], -p['id']))
+        return [{k: v for k, v in p.items() if k != 'sales_count'} for p in top]
+
+
+_index = SuggestIndex()
+
+
+def suggest(q, limit=8):
+    """Top `limit` active products whose name word, SKU or UPC starts with q,
+    best sellers first."""
+    version = catalog_version()
+    if _index.version != version:
+        _index.rebuild(version)
+    return _index.lookup(' '.join(q.lower().split()), limit)
+
+
+def _follow(version):
+    # Adopt the new version only when our own save was the single bump;
+    # anything else means another worker changed the catalog too.
+    if _index.version is not None and _index.version + 1 == version:
+        _index.version = version
+    else:
+        _index.version = None
+
+
+def product_saved(product):
+    """Call after the catalog version was bumped for this save."""
+    if _index.version is None:
+        return
+    _index.upsert(product)
+    _follow(catalog_version())
+
+
+def product_deleted(pid):
+    if _index.version is None:
+        return
+    _index.remove(pid)
+    _follow(catalog_version())
@@ -0,0 +1,43 @@
+"""Job handlers for side effects of a paid order (see shop.jobs).
+
+A job can run twice (a worker dying after the handler but before the job is
+marked done), so each handler flips a flag on the Order in the same transaction
+as its side effect and does nothing if the flag was already set.
+"""
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+from .emails import send_payment_confirmed
+from .inventory import buffer_order
+from .jobs import handler
+from .models import Order, OrderItem, Product
+
+def _first_run(order_id, flag):
+    return Order.objects.filter(id=order_id, **{flag: False}).update(**{flag: True}) == 1
+
+@handler('payment_confirmed_email')
+@transaction.atomic
+def payment_confirmed_email(order_id):
+    if _first_run(order_id, 'confirmation_queued'):
+        send_payment_confirmed(Order.objects.get(id=order_id))
+
+@handler('inventory_deduction')
+def inventory_deduction(order_id):
+    buffer_order(order_id)
+
+@handler('record_sales')
+@transaction.atomic
+def record_sales(order_id):
+    """Add the order's quantities to Product.sales_count in one UPDATE, once per order."""
+    if not _first_run(order_id, 'sales_recorded'):
+        return
+    qty = dict(OrderItem.objects.filter(order_id=order_id)
+               .values('product_id').annotate(q=Sum('quantity')).values_list('product_id', 'q'))
+    if not qty:
+        return
+    Product.objects.filter(id__in=qty).update(sales_count=F('sales_count') + Case(
+        *(When(id=pid, then=Value(q)) for pid, q in qty.items()),
+        default=Value(0), output_field=PositiveIntegerField(),
+    ))
+    # no catalog version bump: bestsellers and the API snapshot refresh on their own TTLs
+
+PAID_ORDER_JOBS = ('payment_confirmed_email', 'inventory_deduction', 'record_sales')
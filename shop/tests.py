@@ -0,0 +1,203 @@
+import json
+import re
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import search, suggest
+from .catalog_cache import catalog_version
+from .catalog_snapshot import _encoding
+from .db import immediate_atomic
+from .models import Category, Job, Order, OrderItem, Product, PromoCode, WebhookEvent
+from .orders import CheckoutError, place_order
+from .tasks import PAID_ORDER_JOBS
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def hot_queries():
+    """(label, queryset, sorted) for the storefront, sync and staff paths. All must avoid
+    full scans; `sorted` ones (paged or LIMITed lists) must also read rows in index order."""
+    now = timezone.now()
+    cat = Category(pk=1)
+    return [
+        ("home: products", Product.objects.filter(active=True)[:24], True),
+        ("home: featured", Product.objects.filter(active=True, featured=True)[:12], True),
+        ("home: bestsellers", Product.objects.filter(active=True).order_by('-sales_count')[:12], True),
+        ("category page", cat.products.filter(active=True), True),
+        ("sync: by variation", Product.objects.filter(square_variation_id__in=['X1', 'X2']), False),
+        ("import: by sku", Product.objects.filter(sku='123'), False),
+        ("import: by upc", Product.objects.filter(upc='123'), False),
+        ("staff: recent orders", Order.objects.order_by('-created')[:200], True),
+        ("staff: export by date", Order.objects.filter(created__gte=now - timedelta(days=7), created__lt=now), True),
+        ("staff: paid orders", Order.objects.filter(paid=True).order_by('-created')[:200], True),
+        ("pickup: slot counts", Order.objects.filter(fulfillment_method='pickup', pickup_at__gte=now,
+                                                     pickup_at__lt=now + timedelta(days=2)).order_by(), False),
+        ("pickup: one slot", Order.objects.filter(fulfillment_method='pickup', pickup_at=now).order_by(), False),
+    ]
+
+
+def problems(plan, ordered):
+    """Full table scans, and for ordered queries sorts the planner couldn't take from an index."""
+    bad = []
+    for line in plan.splitlines():
+        step = re.sub(r'^[\d\s]+', '', line)  # drop the id/parent/notused columns
+        if (step.startswith('SCAN ') and ' USING ' not in step) or (ordered and 'TEMP B-TREE' in step):
+            bad.append(step)
+    return bad
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN on the hot queries, so a model change can't quietly bring back
+    a table scan or an unindexed sort (SQLite's plan format)."""
+
+    def test_hot_queries_use_an_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("reads SQLite's EXPLAIN QUERY PLAN output")
+        for label, qs, ordered in hot_queries():
+            with self.subTest(label):
+                plan = qs.explain()
+                self.assertEqual(problems(plan, ordered), [], f"{qs.query}\n{plan}")
+
+
+class ConcurrentWriteTests(TransactionTestCase):
+    """Parallel read-then-write transactions, like checkout and webhooks, against the
+    file-backed test database (settings DATABASES TEST NAME) with the production PRAGMAs."""
+    THREADS, TRANSACTIONS = 8, 50
+
+    def test_immediate_writers_neither_fail_nor_lose_updates(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("BEGIN IMMEDIATE is SQLite-specific")
+        total = self.THREADS * self.TRANSACTIONS
+        cat = Category.objects.create(name="Candy", slug="candy")
+        product = Product.objects.create(name="Gum", slug="gum", category=cat, price=Decimal('1.00'), stock=total)
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(self.TRANSACTIONS):
+                    try:
+                        with immediate_atomic():
+                            stock = Product.objects.get(pk=product.pk).stock
+                            Product.objects.filter(pk=product.pk).update(stock=stock - 1)
+                    except OperationalError as e:
+                        errors.append(str(e))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 0)
+
+
+class SnapshotEncodingTests(SimpleTestCase):
+    def test_accept_encoding_q_values(self):
+        available = ('identity', 'gzip', 'br')
+        for header, expected in [('gzip, deflate, br', 'br'), ('gzip;q=0, identity', 'identity'),
+                                 ('br;q=0.5, gzip', 'gzip'), ('*;q=0', 'identity'), ('', 'identity')]:
+            with self.subTest(header):
+                request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(_encoding(request, available), expected)
+
+
+class MigrateTests(TestCase):
+    def test_migrate_without_shop_tables(self):
+        # shop commits no migrations, so a plain migrate on a fresh database has no shop tables
+        table_names = connection.introspection.table_names
+        def without_shop(*args, **kwargs):
+            return [t for t in table_names(*args, **kwargs) if not t.startswith('shop_')]
+        with mock.patch.object(connection.introspection, 'table_names', without_shop), \
+                mock.patch.object(search, 'index_products') as index_products:
+            call_command('migrate', verbosity=0)
+        index_products.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SuggestIndexTests(TestCase):
+    def setUp(self):
+        suggest._index = suggest.SuggestIndex()
+        self.cat = Category.objects.create(name="Chips", slug="chips")
+
+    def test_save_inside_atomic_keeps_index_current(self):
+        suggest.suggest('t')  # build it
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            Product.objects.create(name="Takis Fuego", slug="takis", category=self.cat, price=Decimal('2.00'))
+        self.assertEqual(suggest._index.version, catalog_version())
+        self.assertEqual([p['name'] for p in suggest._index.lookup('fuego', 8)], ["Takis Fuego"])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PlaceOrderTests(TestCase):
+    ORDER = {'name': "Ada", 'email': "ada@example.com", 'address': "1 Main St", 'city': "Indianapolis",
+             'state': "IN", 'zip_code': "46201", 'fulfillment_method': 'pickup', 'promo_code': "SAVE10"}
+
+    def setUp(self):
+        cat = Category.objects.create(name="Candy", slug="candy")
+        self.products = [Product.objects.create(name=f"Candy {i}", slug=f"candy-{i}", category=cat,
+                                                price=Decimal('2.50'), stock=10) for i in range(5)]
+        self.promo = PromoCode.objects.create(code="SAVE10", value=Decimal('10'))
+
+    def _cart(self, n, qty=1):
+        return {str(p.id): qty for p in self.products[:n]}
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        with CaptureQueriesContext(connection) as one:
+            place_order(self.ORDER, self._cart(1))
+        with self.assertNumQueries(len(one.captured_queries)):
+            order = place_order(self.ORDER, self._cart(5))
+        self.assertEqual(order.items.count(), 5)
+        self.assertEqual(order.subtotal, Decimal('12.50'))
+        self.assertEqual(order.discount_amount, Decimal('1.25'))
+        self.assertEqual(Product.objects.get(pk=self.products[4].pk).stock, 9)
+
+    def test_oversell_rolls_back_everything(self):
+        cart = self._cart(3)
+        cart[str(self.products[2].id)] = 11
+        with self.assertRaises(CheckoutError):
+            place_order(self.ORDER, cart)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {10})
+        self.assertEqual(PromoCode.objects.get(pk=self.promo.pk).usage_count, 0)
+
+
+@mock.patch.dict('os.environ', {'SQUARE_WEBHOOK_SIGNATURE_KEY': ''})
+class SquareWebhookTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(customer_name="Ada", email="ada@example.com", address="1 Main St",
+                                          city="Indianapolis", state="IN", zip_code="46201", square_order_id="SQ1")
+
+    def _post(self, event_id, event_type="payment.updated"):
+        body = {'event_id': event_id, 'type': event_type,
+                'data': {'object': {'payment': {'order_id': "SQ1", 'status': "COMPLETED"}}}}
+        return self.client.post('/webhooks/square/', json.dumps(body), content_type='application/json')
+
+    def test_first_delivery_marks_paid_and_queues_jobs_once(self):
+        self.assertEqual(self._post("evt-1").json(), {'updated': self.order.id})
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.paid)
+        self.assertEqual(sorted(Job.objects.values_list('kind', flat=True)), sorted(PAID_ORDER_JOBS))
+
+    def test_replayed_event_queues_nothing(self):
+        self._post("evt-1")
+        self.assertEqual(self._post("evt-1").json()['status'], "duplicate")
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(Job.objects.count(), len(PAID_ORDER_JOBS))
+
+    def test_second_event_for_the_same_payment_queues_nothing(self):
+        self._post("evt-1", "payment.created")
+        self._post("evt-2", "payment.updated")
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+        self.assertEqual(Job.objects.count(), len(PAID_ORDER_JOBS))
@@ -4,34 +4,22 @@ from django.contrib import messages
 from django.http import HttpResponseRedirect
 from django.conf import settings
 import os
-from .models import Category, Product, Order, OrderItem, DeliveryZone, DeliveryWindow, PromoCode, PickupWindow, DeliveryRate
+from .models import Category, Product, Order, OrderItem, DeliveryZone, DeliveryWindow, PromoCode
 from .forms import CheckoutForm
 from .square_gate import create_payment_link
 from .emails import send_order_received
 from .fees import compute_tiered_fee
+from .catalog_cache import storefront_page
+from .pickup import available_slots
+from .search import search_products
+from .orders import place_order, CheckoutError
+from .labels import order_labels_pdf
+from django.core.paginator import Paginator
 from decimal import Decimal
 from django.utils import timezone
 from datetime import datetime, timedelta, time
 
-def _pickup_slots(now_local):
-    # Generate 30-min slots for today and tomorrow using DeliveryWindow hours
-    slots = []  # list of (label, value-iso)
-    for day_offset in (0,1):
-        day = now_local.date() + timedelta(days=day_offset)
-        weekday = (now_local + timedelta(days=day_offset)).weekday()
-        windows = PickupWindow.objects.filter(weekday=weekday).order_by('start')
-        for w in windows:
-            start_dt = timezone.make_aware(datetime.combine(day, w.start))
-            end_dt = timezone.make_aware(datetime.combine(day, w.end))
-            cur = start_dt
-            while cur <= end_dt - timedelta(minutes=30):
-                if day_offset == 0 and cur <= now_local:  # don't allow past slots
-                    cur += timedelta(minutes=30); continue
-                label = cur.strftime('%a %b %d, %I:%M %p')
-                slots.append((label, cur.isoformat()))
-                cur += timedelta(minutes=30)
-    return slots
-
+@storefront_page
 def home(request):
     categories = Category.objects.all()
     products = Product.objects.filter(active=True)[:24]
@@ -45,11 +33,13 @@ def home(request):
         'DOORDASH_URL': os.getenv('DOORDASH_URL')
     })
 
+@storefront_page
 def category(request, slug):
     cat = get_object_or_404(Category, slug=slug)
     products = cat.products.filter(active=True)
     return render(request, 'shop/category.html', {'category': cat, 'products': products})
 
+@storefront_page
 def product(request, slug):
     p = get_object_or_404(Product, slug=slug, active=True)
     return render(request, 'shop/product.html', {'product': p})
@@ -87,29 +77,22 @@ def cart_remove(request, product_id):
 # ---- end payment block ----
 def checkout(request):
     # Show the form on GET, process on POST
+    slots = available_slots(timezone.localtime())
     if request.method == "POST":
         form = CheckoutForm(request.POST)
+        form.fields['pickup_slot'].choices = slots
         if form.is_valid():
-            order = form.save(commit=False)
-
-            # delivery fee (by ZIP) if delivery
-            delivery_fee = Decimal('0.00')
-            fulfillment = form.cleaned_data.get('fulfillment')
-            if fulfillment == 'delivery':
-                rate = DeliveryRate.objects.filter(
-                    postal_code=form.cleaned_data.get('zip_code')
-                ).first()
-                if rate:
-                    delivery_fee = Decimal(rate.fee).quantize(Decimal('0.01'))
-
-            order.delivery_fee = delivery_fee
-            order.save()
-
-            # TEMP: skip external payment; go to confirmation page
-            return redirect('thanks', order_id=order.id)
+            try:
+                order = place_order(form.cleaned_data, _get_cart(request.session))
+            except CheckoutError as e:
+                messages.error(request, str(e))
+            else:
+                request.session['cart'] = {}
+                # TEMP: skip external payment; go to confirmation page
+                return redirect('thanks', order_id=order.id)
     else:
         form = CheckoutForm()
-        form.fields['pickup_slot'].choices = _pickup_slots(timezone.localtime())
+        form.fields['pickup_slot'].choices = slots
 
     # Render form if GET or if POST was invalid
     return render(request, 'shop/checkout.html', {'form': form})
@@ -124,14 +107,18 @@ def search(request):
     q = request.GET.get('q','').strip()
     products = []
     if q:
-        products = Product.objects.filter(name__icontains=q, active=True)
+        products = Paginator(search_products(q), 24).get_page(request.GET.get('page'))
     return render(request, 'shop/search.html', {'query': q, 'products': products})
 
 
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_date
 import csv
 
+EXPORT_CHUNK_SIZE = 2000
+
 @staff_member_required
 def staff_orders(request):
     qs = Order.objects.order_by('-created')[:200]
@@ -142,57 +129,57 @@ def staff_print(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     return render(request, 'staff/print.html', {'order': order})
 
+EXPORT_HEADER = ['id','created','name','email','address','city','state','zip','paid','total','promo','discount','delivery_fee','fulfillment','pickup_at','pickup_note','grand_total']
+EXPORT_ITEM_HEADER = ['item_product','item_sku','item_upc','item_qty','item_price','item_line_total']
+
+class _Echo:
+    """File-like sink for csv.writer: writerow() just returns the line."""
+    def write(self, value):
+        return value
+
+def _export_queryset(params):
+    qs = Order.objects.order_by('-created')
+    start, end = parse_date(params.get('start') or ''), parse_date(params.get('end') or '')
+    if start:
+        qs = qs.filter(created__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        qs = qs.filter(created__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    if params.get('paid') in ('0', '1'):
+        qs = qs.filter(paid=params['paid'] == '1')
+    if params.get('fulfillment') in dict(Order.FULFILLMENT):
+        qs = qs.filter(fulfillment_method=params['fulfillment'])
+    return qs
+
+def _export_rows(qs, with_items):
+    yield EXPORT_HEADER + (EXPORT_ITEM_HEADER if with_items else [])
+    if with_items:
+        qs = qs.prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    for o in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = [o.id, o.created, o.customer_name, o.email, o.address, o.city, o.state, o.zip_code, o.paid, o.total, o.promo_code, o.discount_amount, o.delivery_fee, o.fulfillment_method, o.pickup_at, o.pickup_note, o.grand_total]
+        if not with_items:
+            yield row
+            continue
+        items = o.items.all()
+        for it in items:
+            yield row + [it.product.name, it.sku, it.upc, it.quantity, it.price, it.total]
+        if not items:
+            yield row + [''] * len(EXPORT_ITEM_HEADER)
+
 @staff_member_required
 def staff_export_csv(request):
-    qs = Order.objects.order_by('-created')[:500]
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="orders.csv"'
-    w = csv.writer(response)
-    w.writerow(['id','created','name','email','address','city','state','zip','paid','total','promo','discount','delivery_fee','fulfillment','pickup_at','pickup_note'])
-    for o in qs:
-        w.writerow([o.id, o.created, o.customer_name, o.email, o.address, o.city, o.state, o.zip_code, o.paid, o.total, o.promo_code, o.discount_amount, o.delivery_fee, o.fulfillment_method, o.pickup_at, o.pickup_note])
+    """Stream orders as CSV. Filters: start/end (YYYY-MM-DD), paid=0|1,
+    fulfillment=delivery|pickup; items=1 writes one row per order item."""
+    with_items = request.GET.get('items') == '1'
+    writer = csv.writer(_Echo())
+    rows = _export_rows(_export_queryset(request.GET), with_items)
+    response = StreamingHttpResponse((writer.writerow(r) for r in rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="orders{"_items" if with_items else ""}.csv"'
     return response
 
 
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-from django.http import HttpResponse
-
 @staff_member_required
 def staff_labels_pdf(request, order_id):
     order = get_object_or_404(Order, id=order_id)
-    LABEL_W = 54 * mm
-    LABEL_H = 17 * mm
-    MARGIN_X = 2 * mm
-    MARGIN_Y = 1 * mm
-
-    response = HttpResponse(content_type='application/pdf')
+    response = HttpResponse(order_labels_pdf(order), content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="labels_order_{order_id}.pdf"'
-    from reportlab.pdfgen import canvas as rcanvas
-    c = rcanvas.Canvas(response, pagesize=(LABEL_W, LABEL_H))
-
-    for it in order.items.all():
-        name = it.product.name[:32]
-        sku = (it.product.sku or "")[:20]
-        upc = (it.product.upc or "")[:20]
-        allergens = (it.product.allergens or "")[:40]
-
-        c.setFont("Helvetica-Bold", 9)
-        c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 9, name)
-        c.setFont("Helvetica", 7)
-        c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 18, f"SKU: {sku}  UPC: {upc}")
-        if allergens:
-            c.setFont("Helvetica-Oblique", 6)
-            c.drawString(MARGIN_X, MARGIN_Y + 3, f"Allergens: {allergens}")
-        for _ in range(max(1, it.quantity - 1)):
-            c.showPage()
-            c.setFont("Helvetica-Bold", 9)
-            c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 9, name)
-            c.setFont("Helvetica", 7)
-            c.drawString(MARGIN_X, LABEL_H - MARGIN_Y - 18, f"SKU: {sku}  UPC: {upc}")
-            if allergens:
-                c.setFont("Helvetica-Oblique", 6)
-                c.drawString(MARGIN_X, MARGIN_Y + 3, f"Allergens: {allergens}")
-        c.showPage()
-    c.save()
     return response
@@ -1,9 +1,11 @@
 import json, os, re, base64, hmac, hashlib
 from django.views.decorators.csrf import csrf_exempt
+from django.db import IntegrityError
 from django.http import JsonResponse, HttpResponseForbidden
-from .models import Order
-from .square_sync import push_inventory_deduction
-from .emails import send_payment_confirmed
+from .db import immediate_atomic
+from .models import Order, WebhookEvent
+from .jobs import enqueue
+from .tasks import PAID_ORDER_JOBS
 
 def verify_square_signature(request):
     key = os.getenv("SQUARE_WEBHOOK_SIGNATURE_KEY","").encode("utf-8")
@@ -15,6 +17,23 @@ def verify_square_signature(request):
     got = request.headers.get("x-square-hmacsha256-signature") or request.META.get("HTTP_X_SQUARE_HMACSHA256_SIGNATURE")
     return hmac.compare_digest(expected, (got or ""))
 
+def _legacy_order_id(payment, body):
+    """Fallback for payment links created before their Square order id was
+    stored: find "Order #N" in the payment text fields, then the raw body."""
+    fields = []
+    for k in ("note","statement_description","order_id","id"):
+        v = payment.get(k)
+        if isinstance(v, str): fields.append(v)
+
+    pat = re.compile(r"[# ](\d{1,7})")
+    for t in fields:
+        m = pat.search(t)
+        if m:
+            return int(m.group(1))
+    m = re.search(r"Order\s*#?(\d{1,7})", body.decode("utf-8"), re.I)
+    if m: return int(m.group(1))
+    return None
+
 @csrf_exempt
 def square_payment_webhook(request):
     if request.method != "POST":
@@ -27,43 +46,35 @@ def square_payment_webhook(request):
     except Exception:
         return JsonResponse({"status":"ignored","reason":"invalid json"}, status=400)
 
-    # attempt to find Order # in note/description fields
-    payment = data.get("data", {}).get("object", {}).get("payment") or data.get("payment") or {}
-    fields = []
-    for k in ("note","statement_description","order_id","id"):
-        v = payment.get(k)
-        if isinstance(v, str): fields.append(v)
-
-    order_id = None
-    pat = re.compile(r"[# ](\d{1,7})")
-    for t in fields:
-        m = pat.search(t)
-        if m:
-            order_id = int(m.group(1)); break
-    if not order_id:
-        m = re.search(r"Order\s*#?(\d{1,7})", request.body.decode("utf-8"), re.I)
-        if m: order_id = int(m.group(1))
+    # Square delivers at least once: a replayed event_id stops here.
+    event_id = str(data.get("event_id") or "")[:100]
+    if event_id and WebhookEvent.objects.filter(event_id=event_id).exists():
+        return JsonResponse({"status":"duplicate","event_id":event_id})
 
-    if not order_id:
-        return JsonResponse({"status":"ignored","reason":"no order id text"}, status=200)
+    payment = data.get("data", {}).get("object", {}).get("payment") or data.get("payment") or {}
+    order = None
+    sq_order_id = payment.get("order_id")
+    if isinstance(sq_order_id, str) and sq_order_id:
+        order = Order.objects.filter(square_order_id=sq_order_id).first()
+    if order is None:
+        order_id = _legacy_order_id(payment, request.body)
+        if not order_id:
+            return JsonResponse({"status":"ignored","reason":"no order id text"}, status=200)
+        order = Order.objects.filter(id=order_id).first()
+        if order is None:
+            return JsonResponse({"status":"ignored","reason":"unknown order"}, status=200)
+    order_id = order.id
 
+    # Persist and ack fast; emails, Square inventory and sales counts run in run_worker.
     try:
-        order = Order.objects.get(id=order_id)
-        order.paid = True
-        order.save(update_fields=["paid"])
-        # email
-        try: send_payment_confirmed(order)
-        except Exception: pass
-        # inventory deduction
-        try:
-            items = [(i.product.square_variation_id, i.quantity) for i in order.items.all()]
-            push_inventory_deduction(items)
-        except Exception: pass
-        # increment sales_count
-        for it in order.items.all():
-            p = it.product
-            p.sales_count = (p.sales_count or 0) + it.quantity
-            p.save(update_fields=['sales_count'])
-        return JsonResponse({"updated": order_id})
-    except Order.DoesNotExist:
-        return JsonResponse({"status":"ignored","reason":"unknown order"}, status=200)
+        with immediate_atomic():
+            if event_id:
+                WebhookEvent.objects.create(event_id=event_id, event_type=str(data.get("type") or "")[:60], order=order)
+            # Several distinct events (payment.created/updated) can report the same
+            # payment; only the one that flips paid queues the side effects.
+            if Order.objects.filter(id=order.id, paid=False).update(paid=True):
+                for kind in PAID_ORDER_JOBS:
+                    enqueue(kind, order_id=order.id)
+    except IntegrityError:
+        return JsonResponse({"status":"duplicate","event_id":event_id})
+    return JsonResponse({"updated": order_id})
@@ -0,0 +1,105 @@
+"""Process-wide ZIP centroid index for delivery-fee quoting.
+
+`manage.py build_zip_index` flattens the pgeocode US table into a sorted
+(zip, lat, lon) array on disk; workers memory-map it on first use, so a
+lookup is a binary search with no pandas in the request path.
+"""
+import logging
+import os
+import threading
+from math import radians, sin, cos, sqrt, atan2
+
+import numpy as np
+from django.conf import settings
+
+EARTH_RADIUS_MILES = 3958.8
+DTYPE = np.dtype([('zip', '<u4'), ('lat', '<f4'), ('lon', '<f4')])
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_index = None
+
+
+def zip_key(zip_code):
+    z = str(zip_code or '').strip()[:5]
+    return int(z) if len(z) == 5 and z.isdigit() else None
+
+
+def build_from_pgeocode():
+    import pgeocode
+    df = pgeocode.Nominatim('US')._data_frame
+    df = df[['postal_code', 'latitude', 'longitude']].dropna()
+    arr = np.empty(len(df), dtype=DTYPE)
+    n = 0
+    for z, lat, lon in df.itertuples(index=False):
+        key = zip_key(z)
+        if key is None:
+            continue
+        arr[n] = (key, lat, lon)
+        n += 1
+    arr = arr[:n]
+    arr.sort(order='zip', kind='stable')
+    # keep the first centroid for any duplicated ZIP
+    keep = np.ones(n, dtype=bool)
+    keep[1:] = arr['zip'][1:] != arr['zip'][:-1]
+    return arr[keep]
+
+
+def write_index(arr, path):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, np.ascontiguousarray(arr, dtype=DTYPE), allow_pickle=False)
+    os.replace(tmp, path)
+
+
+def load():
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                path = settings.ZIP_INDEX_PATH
+                if os.path.exists(path):
+                    _index = np.load(path, mmap_mode='r', allow_pickle=False)
+                else:
+                    # No prebuilt file: pay the pandas cost once per process.
+                    log.warning("ZIP index %s not found; building it from pgeocode in this worker. "
+                                "Run `manage.py build_zip_index` at deploy time.", path)
+                    _index = build_from_pgeocode()
+    return _index
+
+
+def centroid(zip_code):
+    """(lat, lon) for a ZIP, or None when unknown."""
+    key = zip_key(zip_code)
+    if key is None:
+        return None
+    idx = load()
+    zips = idx['zip']
+    i = int(np.searchsorted(zips, key))
+    if i < len(zips) and zips[i] == key:
+        return float(idx['lat'][i]), float(idx['lon'][i])
+    return None
+
+
+def haversine_miles(a, b):
+    lat1, lon1 = radians(a[0]), radians(a[1])
+    lat2, lon2 = radians(b[0]), radians(b[1])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    h = sin(dlat/2)**2 + cos(lat1)*cos(lat2)*sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_MILES * atan2(sqrt(h), sqrt(1-h))
+
+
+def distances_from(zip_code):
+    """(zips, miles) from one ZIP to every ZIP in the index, in one vectorized pass."""
+    origin = centroid(zip_code)
+    if origin is None:
+        raise KeyError(f"Unknown ZIP {zip_code!r}")
+    idx = load()
+    lat1, lon1 = np.radians(origin[0]), np.radians(origin[1])
+    lat2 = np.radians(idx['lat'].astype(np.float64))
+    lon2 = np.radians(idx['lon'].astype(np.float64))
+    h = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    miles = 2 * EARTH_RADIUS_MILES * np.arctan2(np.sqrt(h), np.sqrt(1 - h))
+    return np.asarray(idx['zip']), miles